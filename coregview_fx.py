@@ -91,4 +91,907 @@ def find_closest_vert(surf_coords, surf):
     import numpy as np
     dist_all = np.sqrt(np.sum((surf - surf_coords) ** 2, axis=1))
     min_dist = dist_all[np.argmin(dist_all)]
-    return dist_all.argmin()
\ No newline at end of file
+    return dist_all.argmin()
+
+
+def load_pial_meshes(fname, reductions=(0.8,)):
+    # PolyData of a FreeSurfer surface followed by decimated copies (level of detail for interaction), cached as
+    # .vtk files next to the surface and rebuilt when the surface is newer
+    import os
+    import numpy as np
+    import pyvista as pv
+    import mne
+
+    fnames_cache = ['%s.vtk' % fname] + ['%s.lod%i.vtk' % (fname, r * 100) for r in reductions]
+    if all(os.path.isfile(f) and os.path.getmtime(f) >= os.path.getmtime(fname) for f in fnames_cache):
+        return [pv.read(f) for f in fnames_cache]
+
+    rr, tris = mne.read_surface(fname)
+    faces = np.empty((len(tris), 4), dtype=np.int64)
+    faces[:, 0] = 3
+    faces[:, 1:] = tris
+    meshes = [pv.PolyData(rr, faces.ravel())]
+    meshes += [meshes[0].decimate(r) for r in reductions]
+    try:
+        for mesh, f in zip(meshes, fnames_cache):
+            mesh.save(f)
+    except OSError as e:
+        print('Could not cache %s: %s' % (fname, e))
+    return meshes
+
+
+def projection_operator(vertices, coords, radius=10.):
+    # Sparse (vertices x contacts) operator painting contact values on the surface: each vertex gets the
+    # Gaussian distance weighted mean of the contacts within radius (mm); vertices with none get empty rows
+    import numpy as np
+    import scipy.sparse
+    from scipy.spatial import cKDTree
+
+    pairs = cKDTree(vertices).sparse_distance_matrix(cKDTree(coords), radius, output_type='ndarray')
+    weights = np.exp(-pairs['v'] ** 2 / (2 * (radius / 2) ** 2))
+    op = scipy.sparse.csr_matrix((weights, (pairs['i'], pairs['j'])), shape=(len(vertices), len(coords)))
+    norm = np.asarray(op.sum(1)).ravel()
+    norm[norm == 0] = 1
+    return scipy.sparse.diags(1 / norm) @ op
+
+
+def load_projection_operator(dir_cache, name, vertices, coords, radius=10., max_mb=None):
+    # projection_operator cached as dir_cache/proj_<name>_<hash>.npz, the hash covering mesh, contacts and radius.
+    # Contacts differ between sessions, so entries are pruned least recently used first above max_mb.
+    import os
+    import hashlib
+    import numpy as np
+    import scipy.sparse
+
+    h = hashlib.sha1()
+    for a in [np.asarray(vertices, dtype=float), np.asarray(coords, dtype=float), np.array([radius])]:
+        h.update(np.ascontiguousarray(a).tobytes())
+    fname = os.path.join(dir_cache, 'proj_%s_%s.npz' % (name, h.hexdigest()[:16]))
+    if os.path.isfile(fname):
+        os.utime(fname)  # mark as recently used
+        return scipy.sparse.load_npz(fname)
+
+    op = projection_operator(vertices, coords, radius=radius).tocsr()
+    try:
+        os.makedirs(dir_cache, exist_ok=True)
+        scipy.sparse.save_npz(fname, op)
+        if max_mb is not None:
+            prune_cache(dir_cache, max_mb, pattern='proj_*.npz')
+    except OSError as e:
+        print('Could not cache %s: %s' % (fname, e))
+    return op
+
+
+def file_signature(fnames):
+    import os
+    sig = []
+    for f in fnames:
+        st = os.stat(f)
+        sig.append('%s:%i:%i' % (os.path.abspath(f), st.st_mtime_ns, st.st_size))
+    return sig
+
+
+def evoked_cache_fname(dir_cache, fnames):
+    import os.path as op
+    import hashlib
+    key = '|'.join(sorted(op.abspath(f) for f in fnames))
+    return op.join(dir_cache, 'evo_%s.npz' % hashlib.sha1(key.encode()).hexdigest())
+
+
+def read_evoked_cache(dir_cache, fnames, params=None, version=3):
+    # params are the settings the arrays were computed with (e.g. baseline), an entry made with others is dropped
+    import os
+    import zipfile
+    import contextlib
+    import numpy as np
+
+    fname = evoked_cache_fname(dir_cache, fnames)
+    if not os.path.isfile(fname):
+        return None
+    try:
+        with np.load(fname, allow_pickle=False) as f:
+            cached = {k: f[k] for k in f.files}
+    except (OSError, ValueError, EOFError, KeyError, zipfile.BadZipFile):
+        cached = None
+
+    # source files or settings changed (or old cache format): drop the entry
+    if (cached is None) or (int(cached.get('version', -1)) != version) or \
+            (list(cached.get('signature', [])) != file_signature(fnames)) or \
+            (str(cached.get('params', '')) != repr(sorted((params or {}).items()))):
+        # a cancelled loader may be dropping the same entry
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(fname)
+        return None
+
+    os.utime(fname)  # mark as recently used
+    return cached
+
+
+def write_evoked_cache(dir_cache, fnames, arrays, params=None, max_mb=None, version=3):
+    import os
+    import threading
+    import numpy as np
+
+    os.makedirs(dir_cache, exist_ok=True)
+    fname = evoked_cache_fname(dir_cache, fnames)
+    fname_tmp = '%s.%i.tmp.npz' % (fname[:-len('.npz')], threading.get_ident())
+    np.savez_compressed(fname_tmp, signature=np.array(file_signature(fnames)),
+                        version=np.array(version), params=np.array(repr(sorted((params or {}).items()))),
+                        **arrays)
+    os.replace(fname_tmp, fname)
+
+    if max_mb is not None:
+        prune_cache(dir_cache, max_mb, pattern='evo_*.npz')
+    return fname
+
+
+def prune_cache(dir_cache, max_mb, pattern='*'):
+    # least recently used entries (oldest mtime) are removed first
+    import os
+    import glob
+
+    entries = []
+    for f in glob.glob(os.path.join(dir_cache, pattern)):
+        st = os.stat(f)
+        entries.append((st.st_mtime, st.st_size, f))
+    entries.sort()
+
+    total = sum(e[1] for e in entries)
+    while entries and total > max_mb * 1e6:
+        _, size, f = entries.pop(0)
+        os.remove(f)
+        total -= size
+    return total
+
+
+def state_nbytes(state):
+    import numpy as np
+    import pandas as pd
+    nbytes = 0
+    for v in state.values():
+        if isinstance(v, pd.DataFrame):
+            nbytes += int(v.memory_usage(deep=True).sum())
+        elif isinstance(v, (np.ndarray, EvokedViews)):
+            nbytes += v.nbytes
+    return nbytes
+
+
+class SessionCache:
+    # in-memory LRU of loaded session states, bounded by the nbytes of the arrays they hold
+    def __init__(self, max_mb=1000):
+        from collections import OrderedDict
+        self.max_bytes = max_mb * 1e6
+        self.entries = OrderedDict()
+        self.sizes = {}
+        self.nbytes = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def get(self, key):
+        if key not in self.entries:
+            return None
+        self.entries.move_to_end(key)
+        return self.entries[key]
+
+    def put(self, key, state):
+        self.pop(key)
+        # views memoized since the entries were added count too
+        self.sizes = {k: state_nbytes(v) for k, v in self.entries.items()}
+        self.nbytes = sum(self.sizes.values())
+        size = state_nbytes(state)
+        if size > self.max_bytes:
+            return
+        while self.entries and self.nbytes + size > self.max_bytes:
+            self.pop(next(iter(self.entries)))
+        self.entries[key] = state
+        self.sizes[key] = size
+        self.nbytes += size
+
+    def pop(self, key):
+        if key in self.entries:
+            del self.entries[key]
+            self.nbytes -= self.sizes.pop(key)
+
+
+class PowerData:
+    # Lazy, dict-like access to the fields of the PP struct of a Power_Phase .mat file: a field is only read the
+    # first time it is used. With h5py the file is converted once to an HDF5 sidecar in dir_cache, chunked by
+    # channel, so channel() can slice ersp_* without reading the whole cube; otherwise the struct is read once.
+    # Results of tf_decompose cached as .npz (see App.fx_compute_power) are read field by field from the archive.
+    def __init__(self, fname, dir_cache=None):
+        import hashlib
+        import os.path as op
+        self.fname = fname
+        self.fname_h5 = None
+        if dir_cache is not None:
+            key = hashlib.sha1(op.abspath(fname).encode()).hexdigest()[:16]
+            self.fname_h5 = op.join(dir_cache, 'power_%s.h5' % key)
+        self.values = {}
+        self.h5 = None
+        self.pp = None
+        self.closed = False
+
+    def open(self):
+        import os
+        if self.h5 is not None or self.pp is not None:
+            return
+        if self.closed:
+            raise ValueError('%s was closed' % self.fname)
+        if self.fname.endswith('.npz'):
+            import numpy as np
+            self.pp = np.load(self.fname, allow_pickle=False)
+            return
+        try:
+            import h5py
+        except ImportError:
+            h5py = None
+        if h5py is not None and self.fname_h5 is not None:
+            sig = file_signature([self.fname])[0]
+            try:
+                if os.path.isfile(self.fname_h5):
+                    with h5py.File(self.fname_h5, 'r') as f:
+                        valid = f.attrs.get('signature') == sig
+                    if not valid:
+                        os.remove(self.fname_h5)
+                if not os.path.isfile(self.fname_h5):
+                    self.write_sidecar(h5py, sig)
+                self.h5 = h5py.File(self.fname_h5, 'r')
+                return
+            except OSError as e:
+                print('Could not use the power sidecar %s: %s' % (self.fname_h5, e))
+        import pymatreader
+        self.pp = pymatreader.read_mat(self.fname)['PP']
+
+    def write_sidecar(self, h5py, sig):
+        import os
+        import threading
+        import numpy as np
+        import pymatreader
+
+        pp = pymatreader.read_mat(self.fname)['PP']
+        os.makedirs(os.path.dirname(self.fname_h5), exist_ok=True)
+        fname_tmp = '%s.%i.tmp' % (self.fname_h5, threading.get_ident())
+        with h5py.File(fname_tmp, 'w') as f:
+            for k, v in pp.items():
+                if isinstance(v, (list, tuple)) and all(isinstance(x, str) for x in v):
+                    f.create_dataset(k, data=v, dtype=h5py.string_dtype())
+                    continue
+                v = np.asarray(v)
+                if v.dtype.kind not in 'biuf':
+                    continue
+                f.create_dataset(k, data=v, chunks=(1,) + v.shape[1:] if v.ndim > 1 else None)
+            f.attrs['signature'] = sig
+        os.replace(fname_tmp, self.fname_h5)
+
+    def __getitem__(self, key):
+        if key not in self.values:
+            self.open()
+            if self.h5 is not None:
+                ds = self.h5[key]
+                self.values[key] = list(ds.asstr()[()]) if ds.dtype.kind == 'O' else ds[()]
+            else:
+                v = self.pp[key]
+                self.values[key] = v.tolist() if getattr(v, 'dtype', None) is not None and v.dtype.kind == 'U' else v
+        return self.values[key]
+
+    def __contains__(self, key):
+        self.open()
+        return key in (self.h5 if self.h5 is not None else self.pp)
+
+    def channel(self, key, ix):
+        # one channel of a channels-first field, sliced from the sidecar when the field is not loaded
+        if key in self.values:
+            return self.values[key][ix]
+        self.open()
+        if self.h5 is not None:
+            return self.h5[key][ix]
+        return self[key][ix]
+
+    def close(self):
+        self.closed = True
+        if self.h5 is not None:
+            self.h5.close()
+            self.h5 = None
+        if hasattr(self.pp, 'close'):
+            self.pp.close()
+            self.pp = None
+
+
+def get_sess_info(fname):
+    split = fname.split('_')
+    sess_info = {}
+    sess_info['subj'] = split[0]
+    sess_info['ch'] = split[1]
+    sess_info['cond'] = split[2]
+    sess_info['intens'] = split[3]
+    return sess_info
+
+
+class Catalog:
+    # SQLite index of subjects and sessions, refreshed incrementally from directory and file mtimes (epochs and
+    # _raw.json). Every call opens its own connection so it can be used from worker threads.
+    def __init__(self, fname, dir_data, dir_base):
+        import os
+        self.fname = fname
+        self.dir_data = dir_data
+        self.dir_base = dir_base
+        os.makedirs(os.path.dirname(fname), exist_ok=True)
+        with self.connect() as con:
+            con.execute('PRAGMA journal_mode=WAL')
+            con.execute('CREATE TABLE IF NOT EXISTS subjects (subj TEXT PRIMARY KEY, mtime REAL, '
+                        'electrodes TEXT, electrodes_mtime REAL)')
+            con.execute('CREATE TABLE IF NOT EXISTS sessions (subj TEXT, sess TEXT, fname_eeg TEXT, '
+                        'fname_ieeg TEXT, info TEXT, stim_ch TEXT, cond TEXT, intens TEXT, mtime REAL, '
+                        'PRIMARY KEY (subj, sess))')
+            # catalogs created before the _raw.json mtime was tracked
+            if 'info_mtime' not in [r['name'] for r in con.execute('PRAGMA table_info(sessions)')]:
+                con.execute('ALTER TABLE sessions ADD COLUMN info_mtime REAL')
+        con.close()
+
+    def connect(self):
+        import sqlite3
+        con = sqlite3.connect(self.fname, timeout=30)
+        con.row_factory = sqlite3.Row
+        return con
+
+    def query(self, sql, args=()):
+        con = self.connect()
+        try:
+            rows = [dict(r) for r in con.execute(sql, args).fetchall()]
+        finally:
+            con.close()
+        return rows
+
+    def subjects(self):
+        return [r['subj'] for r in self.query('SELECT subj FROM subjects ORDER BY subj')]
+
+    def sessions(self, subj):
+        return [r['sess'] for r in self.query('SELECT sess FROM sessions WHERE subj = ? ORDER BY sess', (subj,))]
+
+    def session(self, subj, sess):
+        rows = self.query('SELECT * FROM sessions WHERE subj = ? AND sess = ?', (subj, sess))
+        return rows[0] if rows else None
+
+    def electrodes(self, subj):
+        import io
+        import pandas as pd
+        rows = self.query('SELECT electrodes FROM subjects WHERE subj = ?', (subj,))
+        if not rows or rows[0]['electrodes'] is None:
+            return None
+        return pd.read_csv(io.StringIO(rows[0]['electrodes']), sep='\t')
+
+    def refresh(self, cancelled=None, progress=None):
+        import os
+        # other sub* entries (e.g. sub-02_participants.tsv) are not subjects
+        subjs = sorted(set(f.split('_')[0] for f in os.listdir(self.dir_data) if f.startswith('sub')))
+        subjs = [s for s in subjs if os.path.isdir(os.path.join(self.dir_data, s))]
+        known = self.subjects()
+        con = self.connect()
+        try:
+            with con:
+                for s in set(known) - set(subjs):
+                    con.execute('DELETE FROM subjects WHERE subj = ?', (s,))
+                    con.execute('DELETE FROM sessions WHERE subj = ?', (s,))
+            for ix, s in enumerate(subjs):
+                if cancelled is not None and cancelled():
+                    break
+                if progress is not None:
+                    progress(int(100 * ix / len(subjs)), 'Indexing %s' % s)
+                with con:
+                    self.refresh_subject(s, con=con)
+        finally:
+            con.close()
+        return subjs
+
+    def refresh_subject(self, subj, con=None):
+        import os
+        import os.path as op
+        import json
+
+        own_con = con is None
+        if own_con:
+            con = self.connect()
+        try:
+            row = con.execute('SELECT mtime, electrodes_mtime FROM subjects WHERE subj = ?', (subj,)).fetchone()
+            dir_subj = op.join(self.dir_data, subj)
+            if not op.isdir(dir_subj):
+                return
+            # adding a _raw.json changes the ieeg directory of dir_base
+            dir_info = op.join(self.dir_base, subj, 'ieeg')
+            mtime = max([os.stat(d).st_mtime for d in [dir_subj, dir_info] if op.isdir(d)])
+
+            fname_elecs = op.join(self.dir_base, subj, 'ieeg',
+                                  f'{subj}_task-ccepcoreg_space-MNI152NLin2009aSym_electrodes.tsv')
+            elecs_mtime = os.stat(fname_elecs).st_mtime if op.isfile(fname_elecs) else None
+
+            if row is None:
+                con.execute('INSERT INTO subjects (subj) VALUES (?)', (subj,))
+            if row is None or row['electrodes_mtime'] != elecs_mtime:
+                elecs = None
+                if elecs_mtime is not None:
+                    with open(fname_elecs) as f:
+                        elecs = f.read()
+                con.execute('UPDATE subjects SET electrodes = ?, electrodes_mtime = ? WHERE subj = ?',
+                            (elecs, elecs_mtime, subj))
+            if row is not None and row['mtime'] == mtime:
+                # no sessions added or removed, but a missing _raw.json may have been added or one edited
+                infos = con.execute('SELECT sess, info, info_mtime FROM sessions WHERE subj = ?', (subj,)).fetchall()
+                fnames_info = [op.join(dir_info, f"{subj}_{r['sess']}_raw.json") for r in infos]
+                if all(r['info'] is not None and op.isfile(f) and os.stat(f).st_mtime == r['info_mtime']
+                       for r, f in zip(infos, fnames_info)):
+                    return
+
+            files = sorted(os.listdir(dir_subj))
+            sessions = [f.replace('%s_' % subj, '').replace('_ieeg-epo.fif', '') for f in files
+                        if f.startswith('%s_' % subj) and f.endswith('_ieeg-epo.fif')]
+            con.execute('DELETE FROM sessions WHERE subj = ? AND sess NOT IN (%s)' % ','.join('?' * len(sessions)),
+                        [subj] + sessions)
+            known = {r['sess']: (r['mtime'], r['info_mtime']) for r in
+                     con.execute('SELECT sess, mtime, info_mtime FROM sessions WHERE subj = ?', (subj,)).fetchall()}
+
+            for sess in sessions:
+                fname_ieeg = op.join(dir_subj, '%s_%s_ieeg-epo.fif' % (subj, sess))
+                fname_info = op.join(dir_info, f'{subj}_{sess}_raw.json')
+                sess_mtime = os.stat(fname_ieeg).st_mtime
+                info_mtime = os.stat(fname_info).st_mtime if op.isfile(fname_info) else None
+                if known.get(sess) == (sess_mtime, info_mtime):
+                    continue
+                fnames_eeg = [op.join(dir_subj, f) for f in files if f.startswith('%s_%s_' % (subj, sess))
+                              and f.endswith('-epo.fif') and not f.endswith('_ieeg-epo.fif')]
+                fname_eeg = fnames_eeg[0] if fnames_eeg else None
+
+                info, stim_ch, cond = None, None, None
+                if info_mtime is not None:
+                    info = json.dumps(read_run_json(fname_info))
+                    descr = json.loads(info)['Description'].split(' ')
+                    stim_ch, cond = descr[2], descr[3]
+                try:
+                    intens = get_sess_info('%s_%s' % (subj, sess))['intens']
+                except IndexError:
+                    intens = None
+
+                con.execute('INSERT OR REPLACE INTO sessions (subj, sess, fname_eeg, fname_ieeg, info, stim_ch, cond, '
+                            'intens, mtime, info_mtime) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                            (subj, sess, fname_eeg, fname_ieeg, info, stim_ch, cond, intens, sess_mtime, info_mtime))
+
+            con.execute('UPDATE subjects SET mtime = ? WHERE subj = ?', (mtime, subj))
+            if own_con:
+                con.commit()
+        finally:
+            if own_con:
+                con.close()
+
+
+def evoked_stats_chunked(epochs, picks=None, chunk_size=20, scale=1, cancelled=None):
+    # NaN-aware mean over trials, read chunk_size trials at a time so epochs can stay on disk
+    # (preload=False). Also returns the number of valid trials per sample.
+    import numpy as np
+
+    n_trials = len(epochs)
+    sums, counts = None, None
+    for start in range(0, n_trials, chunk_size):
+        if cancelled is not None and cancelled():
+            return None
+        chunk = epochs.get_data(picks=picks, item=np.arange(start, min(start + chunk_size, n_trials)),
+                                verbose=False)
+        if scale != 1:
+            chunk *= scale
+        valid = ~np.isnan(chunk)
+        chunk[~valid] = 0
+        if sums is None:
+            sums = np.zeros(chunk.shape[1:])
+            counts = np.zeros(chunk.shape[1:], dtype=int)
+        sums += chunk.sum(0)
+        counts += valid.sum(0)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = sums / counts
+    return mean, counts
+
+
+def baseline_mask(times, baseline=(None, -50)):
+    # baseline is a [tmin, tmax) window in the units of times, None meaning the epoch edge
+    import numpy as np
+
+    mask = np.ones(len(times), dtype=bool)
+    if baseline[0] is not None:
+        mask &= times >= baseline[0]
+    if baseline[1] is not None:
+        mask &= times < baseline[1]
+    return mask
+
+
+def baseline_stats(evo, times, baseline=(None, -50)):
+    # evo is times x channels and times are in ms
+    bl = evo[baseline_mask(times, baseline)]
+    return bl.mean(0), bl.std(0)
+
+
+def baseline_views(evo, times, baseline=(None, -50), zscore=True, dtype=None):
+    # Returns the baseline corrected amplitude, the baseline z-score (None if not zscore) and the absolute amplitude,
+    # computed eagerly by the same code as the views of the app (EvokedViews.from_evoked)
+    views = EvokedViews.from_evoked(evo, times, baseline=baseline, zscore=zscore, dtype=dtype)
+    return views['Amplitude'], views['Z-Score'] if zscore else None, views['Absolute']
+
+
+class TimeIndex:
+    # constant time lookup of the sample closest to a time in ms
+    def __init__(self, times):
+        import numpy as np
+        self.times = np.asarray(times)
+        steps = np.diff(self.times)
+        self.t0 = self.times[0]
+        self.step = steps[0] if len(steps) and np.all(steps == steps[0]) else None
+        self.lut = None if self.step is not None else {t: ix for ix, t in enumerate(self.times)}
+
+    def __len__(self):
+        return len(self.times)
+
+    def __getitem__(self, t):
+        import numpy as np
+        if self.step is not None:
+            ix = int(round((t - self.t0) / self.step))
+            return min(max(ix, 0), len(self.times) - 1)
+        if t in self.lut:
+            return self.lut[t]
+        return int(np.abs(self.times - t).argmin())
+
+
+class EvokedViews:
+    # Baseline corrected evoked response (times x channels). The Z-Score and Absolute views are computed the first
+    # time they are requested and kept afterwards.
+    modes = ['Amplitude', 'Z-Score', 'Absolute']
+
+    def __init__(self, evo, times, bl_std=None, tix=None):
+        self.times = times
+        self.tix = TimeIndex(times) if tix is None else tix
+        self.bl_std = None if bl_std is None else bl_std.astype(evo.dtype, copy=False)
+        self.views = {'Amplitude': evo}
+
+    @classmethod
+    def from_evoked(cls, evo, times, baseline=(None, -50), zscore=True, dtype=None, tix=None):
+        # baseline corrects evo (times x channels, not baseline corrected); the Z-Score needs zscore
+        bl_mean, bl_std = baseline_stats(evo, times, baseline=baseline)
+        evo = evo - bl_mean
+        if dtype is not None:
+            evo = evo.astype(dtype, copy=False)
+        return cls(evo, times, bl_std=bl_std if zscore else None, tix=tix)
+
+    def __getitem__(self, mode):
+        import numpy as np
+        if mode not in self.views:
+            if mode == 'Z-Score':
+                if self.bl_std is None:
+                    raise KeyError('No baseline std to compute the Z-Score')
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    self.views[mode] = self.views['Amplitude'] / self.bl_std
+            elif mode == 'Absolute':
+                self.views[mode] = np.abs(self.views['Amplitude'])
+            else:
+                raise KeyError(mode)
+        return self.views[mode]
+
+    def at(self, mode, t):
+        return self[mode][self.tix[t]]
+
+    @property
+    def nbytes(self):
+        nbytes = sum(v.nbytes for v in self.views.values())
+        return nbytes if self.bl_std is None else nbytes + self.bl_std.nbytes
+
+
+def topomap_operator(info, res=64, sphere=None, extrapolate='auto', border='mean'):
+    # Linear operator W (res*res x channels) reproducing the cubic interpolation of mne.viz.plot_topomap,
+    # so that a topomap of data is (W @ data).reshape(res, res). Built from mne's private topomap helpers.
+    import numpy as np
+    from scipy.interpolate import CloughTocher2DInterpolator
+    from mne.channels.layout import _find_topomap_coords
+    from mne.viz.topomap import _check_extrapolate, _check_sphere, _make_head_outlines, _setup_interp
+
+    sphere = _check_sphere(sphere, info)
+    n_chans = len(info['ch_names'])
+    pos = _find_topomap_coords(info, picks=list(range(n_chans)), sphere=sphere)
+    extrapolate = _check_extrapolate(extrapolate, info.get_channel_types(unique=True)[0])
+    outlines = _make_head_outlines(sphere, pos, 'head', (0., 0.))
+    extent, Xi, Yi, interp = _setup_interp(pos, res, 'cubic', extrapolate, outlines, border)
+
+    # values at the extra (extrapolation) points: mean of their channel neighbours, or a constant border
+    extra = np.zeros((interp.n_extra, n_chans))
+    if isinstance(border, str):
+        indices, indptr = interp.tri.vertex_neighbor_vertices
+        used = np.zeros(interp.n_extra, dtype=bool)
+        for ix in range(interp.n_extra):
+            ngb = indptr[indices[n_chans + ix]:indices[n_chans + ix + 1]]
+            ngb = ngb[ngb < n_chans]
+            if len(ngb) > 0:
+                used[ix] = True
+                extra[ix, ngb] = 1. / len(ngb)
+        if used.any():
+            extra[~used] = extra[used].mean(0)
+    # a numeric border would add a constant, the operator is only exact for border=0 in that case
+
+    values = np.vstack([np.eye(n_chans), extra])
+    W = CloughTocher2DInterpolator(interp.tri, values)(Xi, Yi).reshape(-1, n_chans)
+    return W, extent, Xi, Yi
+
+
+def color_cube(values, cmap, vmin, vmax, chunk_size=200, cancelled=None):
+    # RGBA colours (uint8, times x channels x 4) of values (times x channels) mapped through cmap over [vmin, vmax]
+    import numpy as np
+    import matplotlib as mpl
+
+    cmap = mpl.colormaps[cmap] if isinstance(cmap, str) else cmap
+    norm = mpl.colors.Normalize(vmin=vmin, vmax=vmax)
+    cube = np.empty(values.shape + (4,), dtype=np.uint8)
+    for start in range(0, len(values), chunk_size):
+        if cancelled is not None and cancelled():
+            return None
+        cube[start:start + chunk_size] = cmap(norm(values[start:start + chunk_size]), bytes=True)
+    return cube
+
+
+class TopoMovie:
+    # Topomap grids for every sample of evo (times x channels), interpolated with interp_op and stored as uint8
+    # over [vmin, vmax] (255 marks pixels outside the head). Frames are filled in chunks, nearest to center first.
+    def __init__(self, evo, interp_op, vmin, vmax):
+        import numpy as np
+        self.evo = evo
+        self.interp_op = interp_op
+        self.vmin = vmin
+        self.vmax = vmax
+        self.frames = np.zeros((evo.shape[0], interp_op.shape[0]), dtype=np.uint8)
+        self.ready = np.zeros(evo.shape[0], dtype=bool)
+        self.levels = np.r_[np.linspace(vmin, vmax, 255), np.nan]
+        self.center = 0
+
+    def render(self, chunk_size=25, cancelled=None):
+        import numpy as np
+        while not self.ready.all():
+            if cancelled is not None and cancelled():
+                return
+            todo = np.flatnonzero(~self.ready)
+            ixs = todo[np.argsort(np.abs(todo - self.center), kind='stable')[:chunk_size]]
+            grids = self.evo[ixs] @ self.interp_op.T
+            q = np.clip(np.round((grids - self.vmin) / (self.vmax - self.vmin) * 254), 0, 254)
+            q[np.isnan(grids)] = 255
+            self.frames[ixs] = q.astype(np.uint8)
+            self.ready[ixs] = True
+
+    def frame(self, ix):
+        if not self.ready[ix]:
+            return None
+        return self.levels[self.frames[ix]]
+
+
+class MinMaxPyramid:
+    # Min/max envelopes of data (times x channels) over bins of 2, 4, 8... samples, so a trace can be drawn with
+    # a few points per pixel whatever the number of samples.
+    def __init__(self, times, data):
+        import numpy as np
+        self.times = np.asarray(times)
+        self.data = data
+        self.levels = [(data, data)]
+        lo, hi = data, data
+        while len(lo) > 1:
+            if len(lo) % 2:
+                lo, hi = np.vstack([lo, lo[-1:]]), np.vstack([hi, hi[-1:]])
+            lo = np.minimum(lo[0::2], lo[1::2])
+            hi = np.maximum(hi[0::2], hi[1::2])
+            self.levels.append((lo, hi))
+
+    def envelope(self, tmin, tmax, n_pixels):
+        # returns x and y (points x channels) covering [tmin, tmax] with 2 to 4 points per pixel
+        import numpy as np
+        i0 = max(np.searchsorted(self.times, tmin) - 1, 0)
+        i1 = min(np.searchsorted(self.times, tmax) + 1, len(self.times))
+        level = int(np.log2(max((i1 - i0) / max(n_pixels, 1), 1)))
+        level = min(level, len(self.levels) - 1)
+        if level == 0:
+            return self.times[i0:i1], self.data[i0:i1]
+        step = 2 ** level
+        b0, b1 = i0 // step, -(-i1 // step)
+        lo, hi = self.levels[level]
+        x = np.repeat(self.times[::step][b0:b1], 2)
+        y = np.stack([lo[b0:b1], hi[b0:b1]], axis=1).reshape(-1, lo.shape[1])
+        return x, y
+
+
+class BandMeans:
+    # Frequency band averages of an ERSP (channels x freqs x times) read one channel at a time through
+    # channel(ix). The cube is summed cumulatively along frequencies once, so the mean over any band (fmin, fmax]
+    # is the difference of two slices; band means and their averages over a time window are memoized.
+    def __init__(self, channel, n_chans, freqs, times):
+        import numpy as np
+        self.channel = channel
+        self.n_chans = n_chans
+        self.freqs = np.asarray(freqs)
+        self.times = np.asarray(times)
+        self.csum = None
+        self.bands = {}
+        self.windows = {}
+
+    def cumsum(self):
+        import numpy as np
+        if self.csum is None:
+            # kept in the dtype of the source, the sums are over a few tens of frequencies
+            first = np.asarray(self.channel(0))
+            csum = np.zeros((self.n_chans, len(self.freqs) + 1, len(self.times)), dtype=first.dtype)
+            for ix in range(self.n_chans):
+                np.cumsum(first if ix == 0 else self.channel(ix), axis=0, out=csum[ix, 1:])
+            self.csum = csum
+        return self.csum
+
+    def band(self, band):
+        # mean over the freqs in (fmin, fmax], channels x times
+        import numpy as np
+        band = tuple(band)
+        if band not in self.bands:
+            i0, i1 = np.searchsorted(self.freqs, band, side='right')
+            if i1 <= i0:
+                raise ValueError('No frequency in the band (%s, %s] Hz' % band)
+            csum = self.cumsum()
+            self.bands[band] = (csum[:, i1] - csum[:, i0]) / csum.dtype.type(i1 - i0)
+        return self.bands[band]
+
+    def window_mean(self, band, window):
+        # band mean averaged over the times in (tmin, tmax), one value per channel
+        band, window = tuple(band), tuple(window)
+        if (band, window) not in self.windows:
+            win = (self.times > window[0]) & (self.times < window[1])
+            self.windows[(band, window)] = self.band(band)[:, win].mean(1)
+        return self.windows[(band, window)]
+
+
+def tf_cache_fname(dir_cache, fnames, params):
+    # entries are keyed by the source files signature and the parameters, stale ones are left to prune_cache
+    import os.path as op
+    import hashlib
+    key = '|'.join(file_signature(fnames) + [repr(sorted(params.items()))])
+    return op.join(dir_cache, 'tf_%s.npz' % hashlib.sha1(key.encode()).hexdigest())
+
+
+def write_tf_cache(fname, arrays, max_mb=None):
+    import os
+    import threading
+    import numpy as np
+
+    os.makedirs(os.path.dirname(fname), exist_ok=True)
+    fname_tmp = '%s.%i.tmp.npz' % (fname[:-len('.npz')], threading.get_ident())
+    # not compressed, so that PowerData can read one field without inflating the others
+    np.savez(fname_tmp, **arrays)
+    os.replace(fname_tmp, fname)
+
+    if max_mb is not None:
+        prune_cache(os.path.dirname(fname), max_mb, pattern='tf_*.npz')
+    return fname
+
+
+def morlet_fft(sfreq, freqs, n_cycles, n_times):
+    # FFT of complex Morlet wavelets zero-padded to a common fast length, the offset of each wavelet centre and
+    # the mask of the freqs kept: wavelets longer than the epochs would only measure the zero padding, so their
+    # frequencies are dropped
+    import numpy as np
+    from scipy import fft
+    from mne.time_frequency import morlet
+
+    wavelets = morlet(sfreq, freqs, n_cycles=n_cycles, zero_mean=True)
+    fits = np.array([len(w) <= n_times for w in wavelets])
+    if not fits.any():
+        raise ValueError('All wavelets are longer than the epochs (%i samples), use fewer cycles or higher '
+                         'frequencies' % n_times)
+    if not fits.all():
+        print('Wavelets longer than the epochs (%i samples), dropping %s Hz' % (n_times, np.asarray(freqs)[~fits]))
+    wavelets = [w for w, f in zip(wavelets, fits) if f]
+    n_fft = fft.next_fast_len(n_times + max(len(w) for w in wavelets) - 1)
+    w_fft = np.array([fft.fft(w, n_fft) for w in wavelets])
+    return w_fft, [(len(w) - 1) // 2 for w in wavelets], fits
+
+
+def tf_batch(data, w_fft, offsets, decim, bl_ix, boot_ix):
+    # Morlet convolution of data (trials x channels x times) through the FFT. Returns the sums over trials of the
+    # power and of the unit phase vectors (channels x freqs x decimated times), and of the power at the random
+    # baseline samples boot_ix (n_boot x trials) used by the bootstrap (channels x freqs x n_boot).
+    import numpy as np
+    from scipy import fft
+
+    n_trials, n_chans, n_times = data.shape
+    x_fft = fft.fft(data, w_fft.shape[1], axis=-1)
+    power, phase, boot = None, None, None
+    trials = np.arange(n_trials)[None, :]
+    for fi, offset in enumerate(offsets):
+        conv = fft.ifft(x_fft * w_fft[fi], axis=-1)[..., offset:offset + n_times:decim]
+        amp = np.abs(conv)
+        pw = amp ** 2
+        if power is None:
+            power = np.zeros((n_chans, len(offsets), pw.shape[-1]))
+            phase = np.zeros((n_chans, len(offsets), pw.shape[-1]), dtype=complex)
+            boot = np.zeros((n_chans, len(offsets), boot_ix.shape[0]))
+        power[:, fi] = pw.sum(0)
+        phase[:, fi] = np.divide(conv, amp, out=np.zeros_like(conv), where=amp > 0).sum(0)
+        boot[:, fi] = pw[..., bl_ix][trials, :, boot_ix].sum(1).T
+    return power, phase, boot
+
+
+def tf_decompose(epochs, picks=None, freqs=None, n_cycles=5, step=10, baseline=(None, -50), n_boot=200,
+                 alpha=0.05, delta=(0, 4), chunk_size=20, batch_size=8, n_jobs=4, seed=0, progress=None,
+                 cancelled=None):
+    # ERSP (dB from the baseline), phase locking and bootstrap baseline thresholds of epochs, with samples every
+    # step ms. Trials are read chunk_size at a time so epochs can stay on disk (preload=False); the channels of
+    # a chunk are convolved in batches on a thread pool. The baseline is resampled by drawing one baseline sample
+    # per trial n_boot times, and erspboot holds the (alpha/2, 1 - alpha/2) percentiles of the resampled ERSP.
+    # plf_stat is the PLF averaged over frequencies, zeroed where it is not Rayleigh significant at alpha, and
+    # delta the ERSP of the freqs in (delta[0], delta[1]] (channels x times x freqs).
+    import numpy as np
+    from concurrent.futures import ThreadPoolExecutor
+
+    freqs = np.asarray(freqs, dtype=float)
+    sfreq = epochs.info['sfreq']
+    times = epochs.times * 1e3
+    decim = max(int(round(step * sfreq / 1e3)), 1)
+    tf_times = times[::decim]
+    bl_ix = np.flatnonzero(baseline_mask(tf_times, baseline))
+    if len(bl_ix) == 0:
+        raise ValueError('No time-frequency sample in the baseline %s' % (baseline,))
+
+    w_fft, offsets, fits = morlet_fft(sfreq, freqs, n_cycles, len(times))
+    freqs = freqs[fits]
+    rng = np.random.default_rng(seed)
+    n_trials = len(epochs)
+    power, phase, boot = None, None, None
+    with ThreadPoolExecutor(max_workers=n_jobs) as pool:
+        for start in range(0, n_trials, chunk_size):
+            if cancelled is not None and cancelled():
+                return None
+            chunk = epochs.get_data(picks=picks, item=np.arange(start, min(start + chunk_size, n_trials)),
+                                    verbose=False)
+            chunk = np.nan_to_num(chunk)
+            boot_ix = rng.integers(0, len(bl_ix), (n_boot, len(chunk)))
+            if power is None:
+                n_chans = chunk.shape[1]
+                power = np.zeros((n_chans, len(freqs), len(tf_times)))
+                phase = np.zeros((n_chans, len(freqs), len(tf_times)), dtype=complex)
+                boot = np.zeros((n_chans, len(freqs), n_boot))
+            batches = [slice(b, b + batch_size) for b in range(0, chunk.shape[1], batch_size)]
+            jobs = [pool.submit(tf_batch, chunk[:, b], w_fft, offsets, decim, bl_ix, boot_ix) for b in batches]
+            for b, job in zip(batches, jobs):
+                pw, ph, bt = job.result()
+                power[b] += pw
+                phase[b] += ph
+                boot[b] += bt
+            if progress is not None:
+                progress(min(start + chunk_size, n_trials) / n_trials)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        power /= n_trials
+        bl_mean = power[..., bl_ix].mean(-1, keepdims=True)
+        ersp = 10 * np.log10(power / bl_mean)
+        boot = 10 * np.log10(boot / n_trials / bl_mean)
+    erspboot = np.moveaxis(np.percentile(boot, [100 * alpha / 2, 100 * (1 - alpha / 2)], axis=-1), 0, -1)
+    plf = np.abs(phase) / n_trials
+    plf_stat = np.where(plf >= np.sqrt(-np.log(alpha) / n_trials), plf, 0).mean(1)
+    in_delta = (freqs > delta[0]) & (freqs <= delta[1])
+    if not in_delta.any():
+        print('No frequency in the delta band (%s, %s] Hz, using %s Hz' % (delta[0], delta[1], freqs.min()))
+        in_delta = freqs == freqs.min()
+
+    return {'ersp': ersp.astype(np.float32), 'erspboot': erspboot.astype(np.float32),
+            'plf_stat': plf_stat.astype(np.float32), 'delta': ersp[:, in_delta].transpose(0, 2, 1).astype(np.float32),
+            'times': tf_times, 'freqs': freqs}
+
+
+def tf_image(ersp, boot):
+    # RGBA image (freqs x times x 4, uint8) of a channel ERSP (freqs x times): grey inside the bootstrap interval
+    # boot (freqs x 2), coloured outside it; colour limits are symmetric around 0. Also returns the limit.
+    import numpy as np
+    import matplotlib as mpl
+
+    vmax = np.max(np.abs(ersp))
+    norm = mpl.colors.Normalize(vmin=-vmax, vmax=vmax)(ersp)
+    sig = (ersp <= boot[:, :1]) | (ersp >= boot[:, 1:])
+    rgba = np.where(sig[..., None], mpl.colormaps['coolwarm'](norm, bytes=True),
+                    mpl.colormaps['Greys'](norm, bytes=True))
+    return rgba, vmax
@@ -5,6 +5,22 @@ import os.path as op
 dir_base = '/home/eze/mounts/temp2share/EBRAINS_bids/ebrains_eegseeg'
 dir_data = op.join(dir_base, 'derivatives', 'epochs')
 dir_analysis = ''
+dir_cache = op.join(op.expanduser('~'), '.cache', 'coregview')
+cache_max_mb = 2000  # on-disk evoked cache, least recently used sessions are removed first
+mem_cache_mb = 1000  # loaded sessions kept in memory for instant switching
+catalog_file = op.join(dir_cache, 'catalog.sqlite')
+epochs_chunk = 20  # trials read at a time when averaging epochs
+baseline = (None, -50)  # ms
+evo_dtype = None  # e.g. 'float32' to halve the memory of the evoked arrays
+plot_backend = 'matplotlib'  # butterflies backend, 'pyqtgraph' for faster scrubbing (needs pyqtgraph)
+tf_cache_mb = 100  # rendered time-frequency images kept in memory by the Power dialog
+power_bands = {'hf': (20, np.inf)}  # Hz (fmin, fmax], ERSP band averages shown and sortable in the Power dialog
+sort_window = (0, 300)  # ms, default window averaged to sort the Power dialog channels
+tf_freqs = np.arange(2, 46)  # Hz, in-app time-frequency decomposition, used when there is no Power_Phase file
+tf_n_cycles = tf_freqs / 2  # Morlet cycles, scalar or one per frequency; wavelets longer than the epochs are dropped
+tf_step = 10  # ms between time-frequency samples
+tf_n_boot = 200  # baseline resamples of the ERSP bootstrap thresholds
+tf_jobs = 4  # threads convolving channel batches
 
 # DEFS
 dir_resources = op.join(op.dirname(__file__), 'resources')
@@ -1,13 +1,13 @@
 import sys
 import os
-import glob
+import json
+import traceback
 import mne
 import cortex
 import datetime
 import numpy as np
 import pandas as pd
 import os.path as op
-import pymatreader as pym
 import matplotlib as mpl
 import matplotlib.cm as cm
 import matplotlib.pyplot as plt
@@ -15,14 +15,22 @@ import pyvista as pv
 from pyvistaqt import QtInteractor
 from PyQt5.QtWidgets import QApplication, QMainWindow, QVBoxLayout, QWidget, QTextEdit, QTabWidget, QLineEdit, \
     QPushButton, QGridLayout, QComboBox, QListWidget, QSlider, QHBoxLayout, QLabel, QSpinBox, QDialog, QSizePolicy,\
-    QSplitter
-from PyQt5.QtCore import Qt
+    QSplitter, QProgressBar, QCheckBox
+from PyQt5.QtCore import Qt, QThread, QObject, QTimer, pyqtSignal
 from PyQt5.QtGui import QIcon, QFont, QPixmap, QResizeEvent
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas, NavigationToolbar2QT
 from matplotlib.figure import Figure
-from nilearn.plotting import plot_connectome
-from coregview_info import ch185, ix185, dir_data, dir_base, dir_resources, dir_analysis
-from coregview_fx import make_bip_coords, read_run_json, load_pickle, find_closest_vert
+from matplotlib.collections import LineCollection
+from nilearn.plotting.glass_brain import plot_brain_schematics
+from coregview_info import ch185, ix185, dir_data, dir_base, dir_resources, dir_analysis, dir_cache, cache_max_mb, \
+    mem_cache_mb, catalog_file, epochs_chunk, baseline, evo_dtype, plot_backend, \
+    tf_cache_mb, power_bands, sort_window, tf_freqs, tf_n_cycles, tf_step, tf_n_boot, tf_jobs
+from coregview_fx import make_bip_coords, load_pickle, find_closest_vert, read_evoked_cache, \
+    write_evoked_cache, SessionCache, Catalog, get_sess_info, \
+    evoked_stats_chunked, EvokedViews, TimeIndex, \
+    topomap_operator, TopoMovie, color_cube, MinMaxPyramid, load_pial_meshes, \
+    load_projection_operator, PowerData, tf_image, BandMeans, \
+    tf_decompose, tf_cache_fname, write_tf_cache
 
 
 class App(QMainWindow):
@@ -59,15 +67,20 @@ class App(QMainWindow):
         self.mne_info = info_epo
         self.seeg_chans = []
         self.seeg_coords = []
+        self.subj_elecs = None
         self.data = []
         self.seeg_lines = []
         self.current_hdeeg = 0
         self.current_seeg = 0
         self.current_time = 0
         self.evo_hdeeg = []
+        self.seeg_views = None
         self.times = []
+        self.tix = None
         self.seeg_ch_info = []
         self.seeg_show = 'Amplitude'
+        self.seeg_locs = None
+        self.surfaces = None
         self.vmin_seeg = -500
         self.vmax_seeg = 500
         self.vmin_hdeeg = -20
@@ -77,9 +90,14 @@ class App(QMainWindow):
         self.fidu = {}
         self.bf_ready = False
         self.seeg_topo_ready = False
-
-        for h in ['rh', 'lh']:
-            self.pial[h] = mne.read_surface(os.path.join(dir_resources, '%s_norm.pial' % h))
+        self.loader = None
+        self.topo_movie = None
+        self.topo_movie_worker = None
+        self.seeg_cubes = {}  # display mode: ((vmin, vmax), RGBA cube of the contacts colours)
+        self.cube_worker = None
+        self.power_worker = None
+        self.power = None
+        self.power_widget = None
 
         self.main_layout = QVBoxLayout()
         self.menu_layout = QHBoxLayout()
@@ -88,6 +106,7 @@ class App(QMainWindow):
         self.edit_layout = QHBoxLayout()
 
         # Subjects
+        self.catalog = Catalog(catalog_file, self.dir_data, dir_base)
         self.subjs = self.fx_get_subj_names()
         self.subjBox = QComboBox(self)
         for s in ['SUBJECTS'] + self.subjs:
@@ -97,6 +116,7 @@ class App(QMainWindow):
         # Sessions
         self.sessBox = QComboBox(self)
         self.sessBox.addItem('SESSIONS')
+        self.sessBox.activated[str].connect(self.on_sess_select)
 
         # Open Power
         # todo: open power
@@ -336,6 +356,17 @@ class App(QMainWindow):
         # Scroll time
         self.slider_widget = SliderWidget()
         self.slider_widget.slider_time.valueChanged.connect(self.on_slider_change)
+        self.render_scheduler = RenderScheduler(self.render_time, parent=self)
+
+        # butterfly limits are applied once the spinbox edits settle
+        self.hdeeg_lims_timer = QTimer(self)
+        self.hdeeg_lims_timer.setSingleShot(True)
+        self.hdeeg_lims_timer.setInterval(300)
+        self.hdeeg_lims_timer.timeout.connect(self.apply_lims_hdeeg)
+        self.seeg_lims_timer = QTimer(self)
+        self.seeg_lims_timer.setSingleShot(True)
+        self.seeg_lims_timer.setInterval(300)
+        self.seeg_lims_timer.timeout.connect(self.apply_lims_seeg)
         # todo: correct slider size to match butterfly plots
 
         # View layout
@@ -360,11 +391,34 @@ class App(QMainWindow):
         self.main_layout.addLayout(self.edit_layout)
         wid.setLayout(self.main_layout)
 
+        # loaded sessions, switching back to one of them does not read the epochs or the disk cache again
+        self.sess_cache = SessionCache(max_mb=mem_cache_mb)
+
+        # Status
+        self.load_progress = QProgressBar()
+        self.load_progress.setRange(0, 100)
+        self.load_progress.setMaximumWidth(250)
+        self.load_progress.hide()
+        self.statusBar().addPermanentWidget(self.load_progress)
+        self.cache_label = QLabel()
+        self.statusBar().addPermanentWidget(self.cache_label)
+        self.update_cache_label()
+
         print(self.subjs)
 
         # Initialize
         self.init_ui()
 
+        # Index new or changed sessions in the background
+        self.catalog_loader = Worker(self.fx_refresh_catalog)
+        self.catalog_loader.done.connect(self.on_catalog_refreshed)
+        self.catalog_loader.failed.connect(self.on_catalog_failed)
+        self.catalog_loader.start()
+
+    def closeEvent(self, event):
+        Worker.stop_all()
+        super(App, self).closeEvent(event)
+
     def init_ui(self):
         print('Initializing UI')
         self.setWindowTitle(self.title)
@@ -375,179 +429,173 @@ class App(QMainWindow):
         if subj != 'SUBJECTS':
             subj = str(subj)
             self.subj = subj
+            self.cancel_load()
 
-            files = glob.glob(os.path.join(self.dir_data, subj, '%s_*_ieeg-epo.fif' % subj))
-            fnames = [os.path.split(f)[-1] for f in files]
-            sessions = [f.replace('%s_' % subj, '') for f in fnames]
-            sessions = [s.replace('_ieeg-epo.fif', '') for s in sessions]
-
-            self.subj_sessions = sessions
-            self.subj_sessions.sort()
-
-            fname_seeg_coords = op.join(dir_base, self.subj, 'ieeg', f'{self.subj}_task-ccepcoreg_space-MNI152NLin2009aSym_electrodes.tsv')
-            self.seeg_coords = pd.read_csv(fname_seeg_coords, sep='\t')
+            if subj not in self.catalog.subjects():
+                self.catalog.refresh_subject(subj)
+            self.subj_sessions = self.catalog.sessions(subj)
+            self.subj_elecs = self.catalog.electrodes(subj)
 
             self.sessBox.clear()
             self.sessBox.addItem('SESSIONS')
 
             for s in self.subj_sessions:
                 self.sessBox.addItem(s)
-            self.sessBox.activated[str].connect(self.on_sess_select)
 
     def on_sess_select(self, sess):
         if sess != 'SESSIONS':
-
-            fname_ses_info = op.join(dir_base, self.subj, 'ieeg', f'{self.subj}_{sess}_raw.json')
-            self.ses_info = read_run_json(fname_ses_info)
-            self.stim_ch = self.ses_info['Description'].split(' ')[2]
-            self.stim_cond = self.ses_info['Description'].split(' ')[3]
-            self.bf_ready = False
-
-            # Load Data
             sess = str(sess)
             self.sess = sess
-            self.fx_load_data(sess)
-            self.seeg_chans = list(self.data['seeg'].ch_names)
-            # self.bad_chans_ix = self.data['seeg'].info['bads']
-            self.bad_chans = self.data['seeg'].info['bads']
-
-            # self.seeg_chans = [c for c, b in zip(self.seeg_chans, self.bad_chans_ix) if b == 0]
-
-            ch_info_bip = make_bip_coords(self.seeg_coords)
-            # stim_ch = self.sess.split('_')[0]
-
-            # stim info
-            # st_area = ch_info_bip.loc[ch_info_bip.name == self.stim_ch].area.values[0]
-            # self.st_area_value.setText(st_area)
-            #
-            # st_gmpi = ch_info_bip.loc[ch_info_bip.name == self.stim_ch].gmpi.values[0]
-            # self.st_gmpi_value.setText(str(st_gmpi))
-
-            self.stim_coords_mri_norm = ch_info_bip.loc[ch_info_bip.label == self.stim_ch][['x', 'y', 'z']].values
-            # self.stim_coords_surf_norm = ch_info_bip.loc[ch_info_bip.label == self.stim_ch][['x', 'y', 'z']].values[0] #todo
-            # self.stim_coords_surf = ch_info_bip.loc[ch_info_bip.name == stim_ch][['x_surf', 'y_surf', 'z_surf']].values[0]
-
-            # clean channels and sort by oder in data
-            ch_info_bip = ch_info_bip.loc[ch_info_bip.label.isin(self.seeg_chans)]
-            ch_info_bip['label'] = pd.Categorical(ch_info_bip['label'], self.seeg_chans)
-            ch_info_bip = ch_info_bip.sort_values('label')
-
-            self.seeg_ch_info = ch_info_bip
-
-            # Add channels
-            self.seeg_select.clear()
-            for s in ['SEEG'] + self.seeg_chans:
-                self.seeg_select.addItem(s)
-
-            self.times = (self.data['seeg'].times*1e3).astype(int)
-
-            # Plot HDEEG Butterfly
-            self.evo_hdeeg, _, _ = self.make_bf(kind='HDEEG')
-            self.bf_hdeeg.canvas.axes.clear()
-
-            self.hdeeg_lines = self.bf_hdeeg.canvas.plot(self.times, self.evo_hdeeg, names=self.hdeeg_chans, title='HDEEG')
-
-            # Cache for blit when slider changes
-            self.bf_hdeeg_back = self.bf_hdeeg.canvas.copy_from_bbox(self.bf_hdeeg.canvas.axes.bbox)
+            self.bf_ready = False
 
-            ylim_hdeeg = self.bf_hdeeg.canvas.axes.get_ylim()
-            self.vline_hdeeg = self.bf_hdeeg.canvas.axes.plot([0, 0],
-                                                              [ylim_hdeeg[0],
-                                                               ylim_hdeeg[1]],
-                                                              'k--')
-            self.bf_hdeeg.canvas.axes.set_title('HDEEG')
-            self.bf_hdeeg.canvas.axes.set_ylabel(r'Amplitude ($\mu$V)')
-            self.bf_hdeeg.canvas.axes.set_xlabel(r'Time (ms)')
-            self.bf_hdeeg.canvas.draw()
+            # Load data in the background, a new selection cancels the previous load
+            self.cancel_load()
+            state = self.sess_cache.get((self.subj, sess))
+            if state is not None:
+                self.on_sess_loaded(state)
+                return
+
+            self.loader = Worker(self.fx_load_session, self.subj, sess, self.subj_elecs)
+            self.loader.progress.connect(self.on_load_progress)
+            self.loader.done.connect(self.on_sess_loaded)
+            self.loader.failed.connect(self.on_load_failed)
+
+            self.load_progress.setValue(0)
+            self.load_progress.show()
+            self.statusBar().showMessage('Loading %s' % sess)
+            self.loader.start()
+
+    def cancel_load(self):
+        if self.loader is not None:
+            self.loader.requestInterruption()
+            self.loader = None
+            self.load_progress.hide()
+
+    def on_catalog_refreshed(self, subjs):
+        self.subjs = subjs
+        self.subjBox.clear()
+        for s in ['SUBJECTS'] + self.subjs:
+            self.subjBox.addItem(s)
+        if self.subj in self.subjs:
+            self.subjBox.setCurrentText(self.subj)
+            self.subj_sessions = self.catalog.sessions(self.subj)
+            self.sessBox.clear()
+            for s in ['SESSIONS'] + self.subj_sessions:
+                self.sessBox.addItem(s)
+            if self.sess in self.subj_sessions:
+                self.sessBox.setCurrentText(self.sess)
 
-            self.vmax_hdeeg_box.setValue(int(self.vmax_hdeeg))
-            self.vmin_hdeeg_box.setValue(int(self.vmin_hdeeg))
+    def on_catalog_failed(self, msg):
+        self.statusBar().showMessage('Indexing %s failed: %s' % (dir_data, msg))
 
-            # Plot SEEG Butterfly
-            self.evo_seeg, self.evo_z_seeg, self.evo_abs_seeg = self.make_bf(kind='SEEG_bipolar', bad_trials=None)
+    def update_cache_label(self):
+        self.cache_label.setText('Cache: %i sessions, %0.0f/%0.0f MB' % (len(self.sess_cache),
+                                                                         self.sess_cache.nbytes / 1e6,
+                                                                         self.sess_cache.max_bytes / 1e6))
 
-            self.bf_seeg.canvas.axes.clear()
+    def on_load_progress(self, val, msg):
+        self.load_progress.setValue(val)
+        self.statusBar().showMessage(msg)
 
-            if self.seeg_show == 'Amplitude':
-                self.seeg_lines = self.bf_seeg.canvas.plot(self.times, self.evo_seeg, names=self.seeg_chans,
-                                                           title='SEEG', seeg_show=self.seeg_show)
-            elif self.seeg_show == 'Z-Score':
-                self.seeg_lines = self.bf_seeg.canvas.plot(self.times, self.evo_z_seeg, names=self.seeg_chans,
-                                                           title='SEEG', seeg_show=self.seeg_show)
-            elif self.seeg_show == 'Absolute':
-                self.seeg_lines = self.bf_seeg.canvas.plot(self.times, self.evo_abs_seeg, names=self.seeg_chans,
-                                                           title='SEEG', seeg_show=self.seeg_show)
+    def on_load_failed(self, msg):
+        self.loader = None
+        self.load_progress.hide()
+        self.statusBar().showMessage('Loading failed: %s' % msg)
 
-            # Cache for blit when slider changes
-            self.bf_seeg_back = self.bf_seeg.canvas.copy_from_bbox(self.bf_seeg.canvas.axes.bbox)
+    def on_sess_loaded(self, state):
+        # discard results of a stale load
+        if (state['subj'] != self.subj) or (state['sess'] != self.sess):
+            return
+        self.loader = None
+        self.load_progress.hide()
+        self.statusBar().showMessage('%s - %s' % (self.subj, self.sess))
+
+        # epochs are not kept, switching back to the session only needs the evoked arrays
+        self.sess_cache.put((self.subj, self.sess), {k: v for k, v in state.items() if k != 'data'})
+        self.update_cache_label()
+
+        self.ses_info = state['ses_info']
+        self.stim_ch = state['stim_ch']
+        self.stim_cond = state['stim_cond']
+        self.data = state.get('data')
+        self.seeg_chans = state['seeg_chans']
+        self.bad_chans = state['bad_chans']
+        self.stim_coords_mri_norm = state['stim_coords_mri_norm']
+        self.seeg_ch_info = state['seeg_ch_info']
+        self.times = state['times']
+        self.tix = state['seeg_views'].tix
+        self.evo_hdeeg = state['hdeeg_views']['Amplitude']
+        self.seeg_views = state['seeg_views']
+        self.seeg_cubes = {}
+
+        # Add channels
+        self.seeg_select.clear()
+        for s in ['SEEG'] + self.seeg_chans:
+            self.seeg_select.addItem(s)
+
+        # Plot HDEEG Butterfly
+        self.hdeeg_lines = self.bf_hdeeg.canvas.plot(self.times, self.evo_hdeeg, names=self.hdeeg_chans, title='HDEEG',
+                                                     tix=self.tix)
+
+        self.bf_hdeeg.canvas.set_labels(title='HDEEG', ylabel=r'Amplitude ($\mu$V)', xlabel=r'Time (ms)')
+        self.bf_hdeeg.canvas.draw()
 
-            ylim_seeg = self.bf_seeg.canvas.axes.get_ylim()
-            self.vline_seeg = self.bf_seeg.canvas.axes.plot([0, 0],
-                                                            [ylim_seeg[0],
-                                                             ylim_seeg[1]],
-                                                            'k--')
+        self.vmax_hdeeg_box.setValue(int(self.vmax_hdeeg))
+        self.vmin_hdeeg_box.setValue(int(self.vmin_hdeeg))
 
-            self.bf_seeg.canvas.draw()
+        # Plot SEEG Butterfly
+        self.seeg_lines = self.bf_seeg.canvas.plot(self.times, self.seeg_views[self.seeg_show], names=self.seeg_chans,
+                                                   title='SEEG', seeg_show=self.seeg_show)
 
-            self.vmax_seeg_box.setValue(int(self.vmax_seeg))
-            self.vmin_seeg_box.setValue(int(self.vmin_seeg))
+        self.vmax_seeg_box.setValue(int(self.vmax_seeg))
+        self.vmin_seeg_box.setValue(int(self.vmin_seeg))
 
-            self.bf_ready = True  # plot is ready
+        self.bf_ready = True  # plot is ready
 
-            # Plot SEEG Locs
-            self.seeg_coords = self.seeg_ch_info[['x', 'y', 'z']].values
+        # Plot SEEG Locs
+        self.seeg_coords = self.seeg_ch_info[['x', 'y', 'z']].values
+        if self.seeg_locs is None:
             self.seeg_locs = SeegLocs(coords=self.seeg_coords, stim_coords=self.stim_coords_mri_norm,
                                       seeg_show=self.seeg_show)
             self.view_layout.addWidget(self.seeg_locs, 2, 2, 1, 1)
-            self.seeg_topo_ready = True
-            # Set slider range
-            self.slider_widget.set_lims(self.times.min(), self.times.max())
-
-            # if self.data['METADATA']['hdeeg_good_bad'] == 'Good': #todo
-            #     self.hdeeg_good.setPixmap(QPixmap(os.path.join(dir_local,
-            #                                                    'resources', 'hdeeg_good.png')))
-            # else:
-            #     self.hdeeg_good.setPixmap(QPixmap(os.path.join(dir_local,
-            #                                                    'resources', 'hdeeg_bad.png')))
-            #
-            # if self.data['METADATA']['seeg_good_bad'] == 'Good':
-            #     self.seeg_good.setPixmap(QPixmap(os.path.join(dir_local,
-            #                                                   'resources', 'seeg_good.png')))
-            # else:
-            #     self.seeg_good.setPixmap(QPixmap(os.path.join(dir_local,
-            #                                                   'resources', 'seeg_bad.png')))
-            self.bf_ready = True
+        else:
+            self.seeg_locs.set_coords(self.seeg_coords, self.stim_coords_mri_norm)
+        if self.surfaces is not None and self.surfaces.isVisible():
+            self.surfaces.subj_name = self.subj
+            self.surfaces.set_coords(self.seeg_coords, self.seeg_views.at(self.seeg_show, self.current_time),
+                                     [self.vmin_seeg_topo_box.value(), self.vmax_seeg_topo_box.value()],
+                                     'viridis' if self.seeg_show == 'Absolute' else 'bwr')
+        self.seeg_topo_ready = True
+        self.start_color_cube()
+        # Set slider range
+        self.slider_widget.set_lims(self.times.min(), self.times.max())
+        self.start_topo_movie()
+
+        # if self.data['METADATA']['hdeeg_good_bad'] == 'Good': #todo
+        #     self.hdeeg_good.setPixmap(QPixmap(os.path.join(dir_local,
+        #                                                    'resources', 'hdeeg_good.png')))
+        # else:
+        #     self.hdeeg_good.setPixmap(QPixmap(os.path.join(dir_local,
+        #                                                    'resources', 'hdeeg_bad.png')))
+        #
+        # if self.data['METADATA']['seeg_good_bad'] == 'Good':
+        #     self.seeg_good.setPixmap(QPixmap(os.path.join(dir_local,
+        #                                                   'resources', 'seeg_good.png')))
+        # else:
+        #     self.seeg_good.setPixmap(QPixmap(os.path.join(dir_local,
+        #                                                   'resources', 'seeg_bad.png')))
+        self.bf_ready = True
 
     def on_hdeeg_ch_change(self, new_ch):
         new_ch = new_ch.text()
         if new_ch == 'HDEEG':
-            self.hdeeg_lines[self.current_hdeeg].set_c('tab:orange')
-            self.hdeeg_lines[self.current_hdeeg].set_linewidth(1)
-            self.hdeeg_lines[self.current_hdeeg].set_alpha(0.5)
-            self.update_blit(kind='HDEEG')
-
-            self.bf_hdeeg.canvas.draw()
+            self.bf_hdeeg.canvas.highlight(None)
             return
         ix = self.hdeeg_chans.index(new_ch)
         print(new_ch, ix)
 
-        self.hdeeg_lines[self.current_hdeeg].set_c('tab:orange')
-        self.hdeeg_lines[self.current_hdeeg].set_linewidth(1)
-        self.hdeeg_lines[self.current_hdeeg].set_alpha(0.5)
-        self.hdeeg_lines[self.current_hdeeg].set_zorder(self.current_hdeeg)
-
         self.current_hdeeg = ix
-        self.hdeeg_lines[ix].set_c('tab:green')
-        self.hdeeg_lines[ix].set_linewidth(3)
-        self.hdeeg_lines[ix].set_alpha(1)
-        self.hdeeg_lines[ix].set_zorder(300)
-
-        self.vline_hdeeg[0].set_alpha(0)
-        self.bf_hdeeg.canvas.draw()
-        self.bf_hdeeg_back = self.bf_hdeeg.canvas.copy_from_bbox(self.bf_hdeeg.canvas.axes.bbox)
-        self.vline_hdeeg[0].set_alpha(1)
-
-        self.bf_hdeeg.canvas.draw()
+        self.bf_hdeeg.canvas.highlight(ix)
         # self.topo_hdeeg.plot_sel_chan(ix)
 
     def on_seeg_ch_change(self, new_ch):
@@ -556,19 +604,9 @@ class App(QMainWindow):
         except AttributeError:
             return
         if new_ch == 'SEEG':
-            self.seeg_lines[self.current_seeg].set_c('tab:orange')
-            self.seeg_lines[self.current_seeg].set_linewidth(1)
-            self.seeg_lines[self.current_seeg].set_alpha(0.5)
-
-            self.update_blit(kind='SEEG')
-
-            self.bf_seeg.canvas.draw()
+            self.bf_seeg.canvas.highlight(None)
 
-            sizes = np.repeat(15, len(self.seeg_coords))
-            self.seeg_locs.conn.axes['x'].ax.collections[0].set_sizes(sizes)
-            self.seeg_locs.conn.axes['y'].ax.collections[0].set_sizes(sizes)
-            self.seeg_locs.conn.axes['z'].ax.collections[0].set_sizes(sizes)
-            self.seeg_locs.draw()
+            self.seeg_locs.set_sizes(np.repeat(15, len(self.seeg_coords)))
 
             self.area_value.setText('')
             self.gmpi_value.setText('')
@@ -578,30 +616,12 @@ class App(QMainWindow):
         ix = self.seeg_chans.index(new_ch)
         print(new_ch, ix)
 
-        self.seeg_lines[self.current_seeg].set_c('tab:orange')
-        self.seeg_lines[self.current_seeg].set_linewidth(1)
-        self.seeg_lines[self.current_seeg].set_alpha(0.5)
-        self.seeg_lines[self.current_seeg].set_zorder(ix)
-
         self.current_seeg = ix
-        self.seeg_lines[ix].set_c('tab:green')
-        self.seeg_lines[ix].set_linewidth(3)
-        self.seeg_lines[ix].set_alpha(1)
-        self.seeg_lines[ix].set_zorder(300)
-
-        self.vline_seeg[0].set_alpha(0)
-        self.bf_seeg.canvas.draw()
-        self.bf_seeg_back = self.bf_seeg.canvas.copy_from_bbox(self.bf_seeg.canvas.axes.bbox)
-        self.vline_seeg[0].set_alpha(1)
-
-        self.bf_seeg.canvas.draw()
+        self.bf_seeg.canvas.highlight(ix)
 
         sizes = np.repeat(15, len(self.seeg_coords))
         sizes[ix] = 100
-        self.seeg_locs.conn.axes['x'].ax.collections[0].set_sizes(sizes)
-        self.seeg_locs.conn.axes['y'].ax.collections[0].set_sizes(sizes)
-        self.seeg_locs.conn.axes['z'].ax.collections[0].set_sizes(sizes)
-        self.seeg_locs.draw()
+        self.seeg_locs.set_sizes(sizes)
 
         # labels
         # ch_area = self.seeg_ch_info.loc[self.seeg_ch_info.label == new_ch].area.values[0] # todo
@@ -611,55 +631,157 @@ class App(QMainWindow):
         # self.gmpi_value.setText(str(ch_gmpi))
 
     def on_slider_change(self, val):
+        # while dragging only the latest position is drawn, once the previous frame is done
         self.current_time = val
-        ix, = np.where(self.times == val)
-        data = self.evo_hdeeg[ix, :].squeeze()
-        self.topo_hdeeg.plot(data, '%s ms' % self.current_time)
+        if self.tix is not None:
+            self.render_scheduler.request(val)
 
-        self.vline_hdeeg[0].set_xdata([val, val])
-        self.bf_hdeeg.canvas.restore_region(self.bf_hdeeg_back)
-        self.bf_hdeeg.canvas.axes.draw_artist(self.vline_hdeeg[0])
-        self.bf_hdeeg.canvas.blit(self.bf_hdeeg.canvas.axes.bbox)
+    def render_time(self, val):
+        ix = self.tix[val]
+        data = self.evo_hdeeg[ix]
+        grid = None
+        if self.topo_movie is not None:
+            self.topo_movie.center = ix
+            grid = self.topo_movie.frame(ix)
+        self.topo_hdeeg.plot(data, '%s ms' % val, grid=grid)
 
-        self.vline_seeg[0].set_xdata([val, val])
-        self.bf_seeg.canvas.restore_region(self.bf_seeg_back)
-        self.bf_seeg.canvas.axes.draw_artist(self.vline_seeg[0])
-        self.bf_seeg.canvas.blit(self.bf_seeg.canvas.axes.bbox)
+        self.bf_hdeeg.canvas.set_cursor(val)
+        self.bf_seeg.canvas.set_cursor(val)
 
         c_data = self.get_color_data()
 
         self.seeg_locs.plot(data=c_data, coords=self.seeg_coords, sel=None, stim_coords=None)
         # self.seeg_locs.update_cbar(self.vmin_topo_seeg, self.vmax_topo_seeg, title=self.seeg_show)
+        self.update_surfaces()
 
     def on_open_surf(self):
-        ix, = np.where(self.times == self.current_time)
-        if self.seeg_show == 'Amplitude':
-            data = self.evo_seeg[ix, :].squeeze()
-        elif self.seeg_show == 'Z-Score':
-            data = self.evo_z_seeg[ix, :].squeeze()
-        elif self.seeg_show == 'Absolute':
-            data = self.evo_abs_seeg[ix, :].squeeze()
+        if self.surfaces is not None and self.surfaces.isVisible():
+            self.surfaces.raise_()
+            return
+        data = self.seeg_views.at(self.seeg_show, self.current_time)
 
         cmap = 'viridis' if self.seeg_show == 'Absolute' else 'bwr'
 
+        if self.surfaces is not None:
+            # a closed view is only hidden: reuse its plotter and meshes, the session may have changed meanwhile
+            self.surfaces.subj_name = self.subj
+            self.surfaces.set_coords(self.seeg_coords, data,
+                                     [self.vmin_seeg_topo_box.value(), self.vmax_seeg_topo_box.value()], cmap)
+            self.surfaces.show()
+            return
+
         self.surfaces = Surfaces(
             parent=self,
             coords=self.seeg_coords,
             stim_coords=self.stim_coords_mri_norm,  # optional, if available
             vals=data,
             lims=[self.vmin_seeg_topo_box.value(), self.vmax_seeg_topo_box.value()],
+            subj_name=self.subj,
             cmap=cmap
         )
         self.surfaces.show()
 
+    def update_surfaces(self, display=False):
+        # an open 3D view follows the slider, and the display mode and limits when display is True
+        if self.surfaces is None or not self.surfaces.isVisible():
+            return
+        if display:
+            cmap = 'viridis' if self.seeg_show == 'Absolute' else 'bwr'
+            self.surfaces.set_display([self.vmin_seeg_topo_box.value(), self.vmax_seeg_topo_box.value()], cmap)
+        self.surfaces.set_values(self.seeg_views.at(self.seeg_show, self.current_time))
+
+    def get_pial_meshes(self):
+        # full resolution and decimated pial meshes, loaded on first use
+        if not self.pial:
+            for h in ['lh', 'rh']:
+                self.pial[h] = load_pial_meshes(os.path.join(dir_resources, '%s_norm.pial' % h))
+        return self.pial
+
     def on_open_power(self):
         fname_power = os.path.join(dir_analysis, 'Power_Phase', '%s_%s_power.mat' % (self.subj, self.sess))
         if not os.path.isfile(fname_power):
-            print('Power files not found')
+            # no MATLAB results: decompose the session epochs in the background (cached in dir_cache)
+            self.start_power()
             return
-        self.power = pym.read_mat(fname_power)['PP']
+        # fields of the power file are read when a panel first needs them
+        self.open_power(PowerData(fname_power, dir_cache=dir_cache))
+
+    def open_power(self, power):
+        # a previous dialog is closed first, which releases its file handles (see Power.closeEvent)
+        if self.power_widget is not None:
+            self.power_widget.close()
+        self.power = power
         self.power_widget = Power(self, data=self.power)
 
+    def start_power(self):
+        if not self.bf_ready:
+            print('Power files not found')
+            return
+        if self.power_worker is not None:
+            self.power_worker.requestInterruption()
+        self.power_worker = Worker(self.fx_compute_power, self.subj, self.sess)
+        self.power_worker.progress.connect(self.on_load_progress)
+        self.power_worker.done.connect(self.on_power_computed)
+        self.power_worker.failed.connect(self.on_power_failed)
+        self.load_progress.setValue(0)
+        self.load_progress.show()
+        self.statusBar().showMessage('Computing time-frequency decomposition')
+        self.power_worker.start()
+
+    def fx_compute_power(self, worker, subj, sess):
+        # runs in a Worker thread: ERSP, PLF and bootstrap thresholds of the HDEEG and bipolar SEEG epochs, in
+        # the layout of the Power_Phase files
+        fnames = self.fx_get_sess_files(subj, sess)
+        params = {'freqs': tuple(tf_freqs), 'n_cycles': tuple(np.broadcast_to(tf_n_cycles, len(tf_freqs))),
+                  'step': tf_step, 'baseline': baseline, 'n_boot': tf_n_boot, 'version': 2}
+        fname = tf_cache_fname(dir_cache, fnames, params)
+        if os.path.isfile(fname):
+            os.utime(fname)  # mark as recently used
+            return subj, sess, fname
+
+        data = self.fx_load_data(subj, sess)
+        seeg_picks = [ch for ch in data['seeg'].ch_names if ch not in data['seeg'].info['bads']]
+        arrays = {}
+        for ix, (kind, epochs, picks) in enumerate([('hdeeg', data['eeg'], None), ('bipo', data['seeg'], seeg_picks)]):
+            tf = tf_decompose(epochs, picks=picks, freqs=tf_freqs, n_cycles=tf_n_cycles, step=tf_step,
+                              baseline=baseline, n_boot=tf_n_boot, chunk_size=epochs_chunk, n_jobs=tf_jobs,
+                              progress=lambda f, ix=ix, kind=kind: worker.report(int(50 * (ix + f)), 'TF %s' % kind),
+                              cancelled=worker.isInterruptionRequested)
+            if tf is None:
+                return None
+            for k in ['ersp', 'erspboot', 'plf_stat', 'delta']:
+                arrays['%s_%s' % (k, kind)] = tf[k]
+            arrays['ersp_times_%s' % kind] = tf['times']
+            arrays['ersp_freqs_%s' % kind] = tf['freqs']
+            arrays['times'] = tf['times']
+        arrays['ersp_labels_bipo'] = np.array(seeg_picks)
+
+        try:
+            write_tf_cache(fname, arrays, max_mb=cache_max_mb)
+        except OSError as e:
+            print('Could not write time-frequency cache: %s' % e)
+            return None
+        return subj, sess, fname
+
+    def on_power_computed(self, result):
+        if self.sender() is not self.power_worker:
+            return
+        self.power_worker = None
+        self.load_progress.hide()
+        if result is None:
+            self.statusBar().showMessage('Time-frequency decomposition failed')
+            return
+        subj, sess, fname = result
+        if (subj, sess) != (self.subj, self.sess):
+            return
+        self.statusBar().showMessage('%s - %s' % (self.subj, self.sess))
+        self.open_power(PowerData(fname))
+
+    def on_power_failed(self, msg):
+        self.power_worker = None
+        self.load_progress.hide()
+        self.statusBar().showMessage('Time-frequency decomposition failed: %s' % msg)
+
     def on_open_pci(self):
         fname_pci_st = os.path.join(dir_analysis, 'PCI', '%s_%s-pci-st.pkl' % (self.subj, self.sess))
         fname_pci_lz = os.path.join(dir_analysis, 'PCI', '%s_%s-pci-lz.pkl' % (self.subj, self.sess))
@@ -688,26 +810,15 @@ class App(QMainWindow):
 
     def on_change_seeg_show(self, show):
         self.seeg_show = str(show)
-        self.bf_seeg.canvas.axes.clear()
-
-        if show == 'Z-Score':
-            self.seeg_lines = self.bf_seeg.canvas.plot(self.times, self.evo_z_seeg, names=self.seeg_chans, title='SEEG',
-                                                       seeg_show='Z-Score')
-            self.bf_seeg.canvas.axes.set_ylabel('Z-Score')
-            self.seeg_locs.cb1.set_label('Z-Score')
-
-        elif show == 'Amplitude':
-            self.seeg_lines = self.bf_seeg.canvas.plot(self.times, self.evo_seeg, names=self.seeg_chans, title='SEEG')
-            self.bf_seeg.canvas.axes.set_ylabel(r'Amplitude ($\mu$V)')
-            self.seeg_locs.cb1.set_label(r'Amplitude ($\mu$V)')
 
-        elif show == 'Absolute':
-            self.seeg_lines = self.bf_seeg.canvas.plot(self.times, self.evo_abs_seeg, names=self.seeg_chans, title='SEEG',
-                                                       seeg_show='Absolute')
-            self.bf_seeg.canvas.axes.set_ylabel(r'Absolute Amplitude ($\mu$V)')
-            self.seeg_locs.cb1.set_label(r'Absolute Amplitude ($\mu$V)')
+        self.seeg_lines = self.bf_seeg.canvas.plot(self.times, self.seeg_views[self.seeg_show], names=self.seeg_chans,
+                                                   title='SEEG', seeg_show=self.seeg_show, tix=self.tix)
+        ylabel = {'Amplitude': r'Amplitude ($\mu$V)', 'Z-Score': 'Z-Score',
+                  'Absolute': r'Absolute Amplitude ($\mu$V)'}[self.seeg_show]
+        self.bf_seeg.canvas.set_labels(ylabel=ylabel)
+        self.seeg_locs.cb1.set_label(ylabel)
 
-        ylim_seeg = self.bf_seeg.canvas.axes.get_ylim()
+        ylim_seeg = self.bf_seeg.canvas.get_ylim()
 
         self.vmin_seeg = ylim_seeg[0]
         self.vmax_seeg = ylim_seeg[1]
@@ -717,14 +828,7 @@ class App(QMainWindow):
         self.vmin_seeg_box.setValue(int(ylim_seeg[0]))
         self.bf_ready = True
 
-        self.vline_seeg = self.bf_seeg.canvas.axes.plot([self.current_time, self.current_time],
-                                                        [ylim_seeg[0],
-                                                         ylim_seeg[1]],
-                                                        'k--')
-        self.bf_seeg.canvas.axes.set_title('SEEG')
-        self.bf_seeg.canvas.axes.set_xlabel(r'Time (ms)')
-
-        self.update_blit(kind='SEEG')
+        self.bf_seeg.canvas.set_labels(title='SEEG', xlabel=r'Time (ms)')
 
         self.bf_seeg.canvas.draw()
 
@@ -739,10 +843,12 @@ class App(QMainWindow):
         self.vmin_seeg_topo_box.setValue(int(vmin_seeg_topo))
         self.vmax_seeg_topo_box.setValue(int(vmax_seeg_topo))
         self.seeg_topo_ready = True
+        self.start_color_cube()
         c_data = self.get_color_data()
         self.seeg_locs.plot(data=c_data, coords=self.seeg_coords, sel=None, stim_coords=None, seeg_show=self.seeg_show)
         self.seeg_locs.update_cbar(self.vmin_seeg_topo_box.value(), self.vmax_seeg_topo_box.value(), title=self.seeg_show)
         self.seeg_locs.draw()
+        self.update_surfaces(display=True)
 
         print(self.vmin_seeg, self.vmax_seeg)
 
@@ -750,153 +856,273 @@ class App(QMainWindow):
         self.vmin_topo_hdeeg = self.vmin_hdeeg_topo_box.value()
         self.vmax_topo_hdeeg = self.vmax_hdeeg_topo_box.value()
 
-        ix, = np.where(self.times == self.current_time)
-        data = self.evo_hdeeg[ix, :].squeeze()
+        data = self.evo_hdeeg[self.tix[self.current_time]]
 
         self.topo_hdeeg.vmin = self.vmin_topo_hdeeg
         self.topo_hdeeg.vmax = self.vmax_topo_hdeeg
         self.topo_hdeeg.plot(data, title='%s ms' % self.current_time)
         self.topo_hdeeg.update_cbar(self.vmin_topo_hdeeg, self.vmax_topo_hdeeg)
+        self.start_topo_movie()
+
+    def start_topo_movie(self):
+        # pre-render the topomaps of the whole session, quantized to the current limits
+        if self.topo_movie_worker is not None:
+            self.topo_movie_worker.requestInterruption()
+        self.topo_movie = None
+        if self.tix is None or self.topo_hdeeg.im is None:
+            return
+        self.topo_movie = TopoMovie(self.evo_hdeeg, self.topo_hdeeg.interp_op, self.topo_hdeeg.vmin,
+                                    self.topo_hdeeg.vmax)
+        self.topo_movie.center = self.tix[self.current_time]
+        self.topo_movie_worker = Worker(self.fx_render_topo_movie, self.topo_movie)
+        self.topo_movie_worker.start()
+
+    def fx_render_topo_movie(self, worker, movie):
+        movie.render(cancelled=worker.isInterruptionRequested)
 
     def on_change_lims_hdeeg(self):
+        if self.bf_ready:
+            self.hdeeg_lims_timer.start()
+
+    def apply_lims_hdeeg(self):
         if self.bf_ready:
             self.vmin_hdeeg = self.vmin_hdeeg_box.value()
             self.vmax_hdeeg = self.vmax_hdeeg_box.value()
-
-            self.bf_hdeeg.canvas.axes.clear()
-            self.hdeeg_lines = self.bf_hdeeg.canvas.plot(self.times, self.evo_hdeeg, names=self.hdeeg_chans, title='HDEEG',
-                                                         ylim=[self.vmin_hdeeg, self.vmax_hdeeg])
-            self.update_blit(kind='HDEEG')
-            ylim_hdeeg = self.bf_hdeeg.canvas.axes.get_ylim()
-            self.vline_hdeeg = self.bf_hdeeg.canvas.axes.plot([self.current_time, self.current_time],
-                                                              [ylim_hdeeg[0],
-                                                               ylim_hdeeg[1]],
-                                                              'k--')
-            self.bf_hdeeg.canvas.draw()
+            self.bf_hdeeg.canvas.set_ylim([self.vmin_hdeeg, self.vmax_hdeeg])
 
     def on_change_lims_topo_seeg(self):
         if self.seeg_topo_ready:
+            self.start_color_cube()
             c_data = self.get_color_data()
 
             self.seeg_locs.plot(data=c_data, coords=self.seeg_coords, sel=None, stim_coords=None, seeg_show=self.seeg_show)
             self.seeg_locs.update_cbar(self.vmin_seeg_topo_box.value(), self.vmax_seeg_topo_box.value(), title=self.seeg_show)
+            self.update_surfaces(display=True)
 
     def on_change_lims_seeg(self):
+        if self.bf_ready:
+            self.seeg_lims_timer.start()
+
+    def apply_lims_seeg(self):
         if self.bf_ready:
             self.vmin_seeg = self.vmin_seeg_box.value()
             self.vmax_seeg = self.vmax_seeg_box.value()
-
-            self.bf_seeg.canvas.axes.clear()
-            if self.seeg_show == 'Amplitude':
-                self.seeg_lines = self.bf_seeg.canvas.plot(self.times, self.evo_seeg, names=self.seeg_chans, title='SEEG',
-                                                           ylim=[self.vmin_seeg, self.vmax_seeg])
-            else:
-                self.seeg_lines = self.bf_seeg.canvas.plot(self.times, self.evo_z_seeg, names=self.seeg_chans, title='SEEG',
-                                                           seeg_show='Z-Score', ylim=[self.vmin_seeg, self.vmax_seeg])
-
-            self.update_blit(kind='SEEG')
-
-            ylim_seeg = self.bf_seeg.canvas.axes.get_ylim()
-            self.vline_seeg = self.bf_seeg.canvas.axes.plot([self.current_time, self.current_time],
-                                                            [ylim_seeg[0],
-                                                            ylim_seeg[1]],
-                                                            'k--')
-
-            self.bf_seeg.canvas.draw()
+            self.bf_seeg.canvas.set_ylim([self.vmin_seeg, self.vmax_seeg])
 
     def on_open_comm(self):
         self.comments = Comments(self, dir_comments=self.dir_comments, session=self.sess, subject=self.subj)
 
     def fx_get_subj_names(self):
-        files = os.listdir(self.dir_data)
-        subjs = []
-        for f in files:
-            if f.startswith('sub'):
-                subjs.append(f.split('_')[0])
-        subjs = list(set(subjs))
-        subjs.sort()
-        return subjs
+        return self.catalog.subjects()
+
+    def fx_refresh_catalog(self, worker):
+        return self.catalog.refresh(cancelled=worker.isInterruptionRequested)
 
     def fx_get_sess_info(self, fname):
-        split = fname.split('_')
-        sess_info = {}
-        sess_info['subj'] = split[0]
-        sess_info['ch'] = split[1]
-        sess_info['cond'] = split[2]
-        sess_info['intens'] = split[3]
-        return sess_info
-
-    def fx_load_data(self, sess):
-        fnames = glob.glob(os.path.join(self.dir_data, self.subj,'%s_%s*' % (self.subj, sess)))
-        data = {'eeg': mne.read_epochs(fnames[0], verbose=False, preload=True),
-                'seeg': mne.read_epochs(fnames[1], verbose=False, preload=True)}
-        data['seeg'].drop_channels(data['seeg'].info['bads'])
-        data['eeg']._data *= 1e6
-        data['seeg']._data *= 1e6
-        self.data = {'eeg': data['eeg'], 'seeg': data['seeg']}
-        del data
+        return get_sess_info(fname)
+
+    def fx_get_sess_files(self, subj, sess):
+        # [eeg, ieeg] epochs files
+        row = self.catalog.session(subj, sess)
+        return [row['fname_eeg'], row['fname_ieeg']]
+
+    def fx_load_data(self, subj, sess):
+        # epochs stay on disk, trials are read in chunks when averaging (see make_bf)
+        fnames = self.fx_get_sess_files(subj, sess)
+        data = {'eeg': mne.read_epochs(fnames[0], verbose=False, preload=False),
+                'seeg': mne.read_epochs(fnames[1], verbose=False, preload=False)}
+        return data
+
+    def fx_load_session(self, worker, subj, sess, elecs):
+        # runs in a Worker thread: must not touch widgets or the current session state
+        state = {'subj': subj, 'sess': sess}
+
+        row = self.catalog.session(subj, sess)
+        if row['info'] is None:
+            raise FileNotFoundError('No %s_%s_raw.json in %s' % (subj, sess, os.path.join(dir_base, subj, 'ieeg')))
+        state['ses_info'] = json.loads(row['info'])
+        state['stim_ch'] = row['stim_ch']
+        state['stim_cond'] = row['cond']
+
+        fnames = [row['fname_eeg'], row['fname_ieeg']]
+        params = {'baseline': baseline, 'evo_dtype': evo_dtype}
+        cached = read_evoked_cache(dir_cache, fnames, params=params)
+        if cached is not None:
+            worker.report(50, 'Reading cached evoked responses')
+            state['data'] = None
+            state['seeg_chans'] = cached['seeg_chans'].tolist()
+            state['bad_chans'] = cached['bad_chans'].tolist()
+            state['times'] = cached['times']
+            tix = TimeIndex(state['times'])
+            state['hdeeg_views'] = EvokedViews(cached['evo_hdeeg'], state['times'], tix=tix)
+            state['seeg_views'] = EvokedViews(cached['evo_seeg'], state['times'], bl_std=cached['bl_std_seeg'], tix=tix)
+        else:
+            worker.report(5, 'Reading epochs')
+            data = self.fx_load_data(subj, sess)
+            state['data'] = data
+            state['bad_chans'] = data['seeg'].info['bads']
+            state['seeg_chans'] = [ch for ch in data['seeg'].ch_names if ch not in state['bad_chans']]
+            state['times'] = (data['seeg'].times*1e3).astype(int)
+            tix = TimeIndex(state['times'])
+
+            worker.report(10, 'Averaging HDEEG epochs')
+            state['hdeeg_views'] = self.make_bf(data['eeg'], state['times'], kind='HDEEG', tix=tix,
+                                                cancelled=worker.isInterruptionRequested)
+            if worker.isInterruptionRequested():
+                return None
+            worker.report(50, 'Averaging SEEG epochs')
+            state['seeg_views'] = self.make_bf(data['seeg'], state['times'], kind='SEEG_bipolar', bad_trials=None,
+                                               picks=state['seeg_chans'], tix=tix,
+                                               cancelled=worker.isInterruptionRequested)
+            if worker.isInterruptionRequested():
+                return None
+
+            try:
+                write_evoked_cache(dir_cache, fnames, params=params, max_mb=cache_max_mb,
+                                   arrays={'seeg_chans': np.asarray(state['seeg_chans']),
+                                           'bad_chans': np.asarray(state['bad_chans']),
+                                           'times': state['times'],
+                                           'evo_hdeeg': state['hdeeg_views']['Amplitude'],
+                                           'evo_seeg': state['seeg_views']['Amplitude'],
+                                           'bl_std_seeg': state['seeg_views'].bl_std})
+            except OSError as e:
+                print('Could not write evoked cache: %s' % e)
+
+        worker.report(95, 'Matching contact coordinates')
+        ch_info_bip = make_bip_coords(elecs)
+        # stim_ch = self.sess.split('_')[0]
+
+        # stim info
+        # st_area = ch_info_bip.loc[ch_info_bip.name == self.stim_ch].area.values[0]
+        # self.st_area_value.setText(st_area)
+        #
+        # st_gmpi = ch_info_bip.loc[ch_info_bip.name == self.stim_ch].gmpi.values[0]
+        # self.st_gmpi_value.setText(str(st_gmpi))
+
+        state['stim_coords_mri_norm'] = ch_info_bip.loc[ch_info_bip.label == state['stim_ch']][['x', 'y', 'z']].values
+        # self.stim_coords_surf_norm = ch_info_bip.loc[ch_info_bip.label == self.stim_ch][['x', 'y', 'z']].values[0] #todo
+        # self.stim_coords_surf = ch_info_bip.loc[ch_info_bip.name == stim_ch][['x_surf', 'y_surf', 'z_surf']].values[0]
+
+        # clean channels and sort by oder in data
+        ch_info_bip = ch_info_bip.loc[ch_info_bip.label.isin(state['seeg_chans'])]
+        ch_info_bip['label'] = pd.Categorical(ch_info_bip['label'], state['seeg_chans'])
+        ch_info_bip = ch_info_bip.sort_values('label')
+        state['seeg_ch_info'] = ch_info_bip
+
+        worker.report(100, 'Done')
+        return state
 
     def get_color_data(self):
-        ix, = np.where(self.times == self.current_time)
-        if self.seeg_show == 'Amplitude':
-            data = self.evo_seeg[ix, :].squeeze()
-        elif self.seeg_show == 'Z-Score':
-            data = self.evo_z_seeg[ix, :].squeeze()
-        elif self.seeg_show == 'Absolute':
-            data = np.abs(self.evo_seeg[ix, :].squeeze())
+        lims = (self.vmin_seeg_topo_box.value(), self.vmax_seeg_topo_box.value())
+        cube = self.seeg_cubes.get(self.seeg_show)
+        if cube is not None and cube[0] == lims:
+            return cube[1][self.tix[self.current_time]] / 255.
+        # colours are mapped here until the cube for these limits is ready
+        data = self.seeg_views.at(self.seeg_show, self.current_time)
         # sp = cm.get_cmap('viridis', 256) if self.seeg_show == 'Absolute' else cm.get_cmap('bwr', 256)
         sp = mpl.colormaps['viridis'] if self.seeg_show == 'Absolute' else mpl.colormaps['bwr']
-        norm = mpl.colors.Normalize(vmin=self.vmin_seeg_topo_box.value(), vmax=self.vmax_seeg_topo_box.value())
+        norm = mpl.colors.Normalize(vmin=lims[0], vmax=lims[1])
         c_data = sp(norm(data))
         return c_data
 
-    def make_bf(self, kind, bad_trials=None):
-        if kind == 'SEEG_bipolar':
-            epo = self.data['seeg'].get_data()
-            evo_z = None
-        else:
-            epo = self.data['eeg'].get_data()
-            evo_z = None
-        evo = np.nanmean(epo, 0).T
-
-        if kind == 'SEEG_bipolar':
-            evo_z = evo.copy()
-
-        for ix_ch, ch in enumerate(evo.T):
-            baseline = ch[self.times < -0.05]
-            bl_mean = np.mean(baseline)
-
-            # z-score
-            if kind == 'SEEG_bipolar':
-                bl_std = np.std(baseline)
-                evo_z[:, ix_ch] = (evo[:, ix_ch] - bl_mean) / bl_std
-
-            evo[:, ix_ch] = evo[:, ix_ch] - bl_mean
-
-        evo_abs = np.abs(evo)
-        # evo_z[np.isnan(evo_z)] = 0
-        return evo, evo_z, evo_abs
-
-    def update_blit(self, kind=None):
-        if kind == 'SEEG':
-            self.vline_seeg[0].set_alpha(0)
-            self.bf_seeg.canvas.draw()
-            self.bf_seeg_back = self.bf_seeg.canvas.copy_from_bbox(self.bf_seeg.canvas.axes.bbox)
-            self.vline_seeg[0].set_alpha(1)
-
-        elif kind == 'HDEEG':
-            self.vline_hdeeg[0].set_alpha(0)
-            self.bf_hdeeg.canvas.draw()
-            self.bf_hdeeg_back = self.bf_hdeeg.canvas.copy_from_bbox(self.bf_hdeeg.canvas.axes.bbox)
-            self.vline_hdeeg[0].set_alpha(1)
-
-    # todo: fix blit when resizing window
-    # def resizeEvent(self, event):
-    #     print("resize")
-    #     QMainWindow.resizeEvent(self, event)
-    #     if hasattr(App, 'vline_seeg'):
-    #         self.update_blit('SEEG')
-    #         self.update_blit('HDEEG')
+    def start_color_cube(self):
+        # precompute the contacts colours of all time points for the current mode and limits
+        lims = (self.vmin_seeg_topo_box.value(), self.vmax_seeg_topo_box.value())
+        cube = self.seeg_cubes.get(self.seeg_show)
+        if self.seeg_views is None or (cube is not None and cube[0] == lims):
+            return
+        if self.cube_worker is not None:
+            self.cube_worker.requestInterruption()
+        cmap = 'viridis' if self.seeg_show == 'Absolute' else 'bwr'
+        self.cube_worker = Worker(self.fx_color_cube, self.seeg_show, self.seeg_views[self.seeg_show], cmap, lims)
+        self.cube_worker.done.connect(self.on_color_cube)
+        self.cube_worker.start()
+
+    def fx_color_cube(self, worker, show, values, cmap, lims):
+        cube = color_cube(values, cmap, lims[0], lims[1], cancelled=worker.isInterruptionRequested)
+        return show, lims, cube
+
+    def on_color_cube(self, result):
+        show, lims, cube = result
+        if cube is not None and self.sender() is self.cube_worker:
+            self.seeg_cubes[show] = (lims, cube)
+
+    def make_bf(self, epochs, times, kind, bad_trials=None, picks=None, tix=None, cancelled=None):
+        stats = evoked_stats_chunked(epochs, picks=picks, chunk_size=epochs_chunk, scale=1e6, cancelled=cancelled)
+        if stats is None:
+            return None
+        # Z-Score and Absolute are only computed if they are shown
+        return EvokedViews.from_evoked(stats[0].T, times, baseline=baseline, zscore=kind == 'SEEG_bipolar',
+                                       dtype=evo_dtype, tix=tix)
+
+class Worker(QThread):
+    # Runs fx(worker, *args, **kwargs) off the GUI thread. fx reports through worker.report and should
+    # return early when worker.isInterruptionRequested(); interrupted runs never emit done.
+    progress = pyqtSignal(int, str)
+    done = pyqtSignal(object)
+    failed = pyqtSignal(str)
+
+    active = set()  # keep running threads referenced until they finish
+
+    def __init__(self, fx, *args, **kwargs):
+        super(Worker, self).__init__()
+        self.fx = fx
+        self.args = args
+        self.kwargs = kwargs
+        self.finished.connect(self.on_finished)
+
+    def start(self, *args):
+        Worker.active.add(self)
+        super(Worker, self).start(*args)
+
+    def run(self):
+        try:
+            result = self.fx(self, *self.args, **self.kwargs)
+        except Exception as e:
+            traceback.print_exc()
+            if not self.isInterruptionRequested():
+                self.failed.emit(str(e))
+            return
+        if not self.isInterruptionRequested():
+            self.done.emit(result)
+
+    def report(self, val, msg=''):
+        self.progress.emit(val, msg)
+
+    def on_finished(self):
+        Worker.active.discard(self)
+
+    @staticmethod
+    def stop_all():
+        # interrupt all running workers and wait for them, a QThread destroyed while running aborts the app
+        workers = list(Worker.active)
+        for w in workers:
+            w.requestInterruption()
+        for w in workers:
+            w.wait()
+
+
+class RenderScheduler(QObject):
+    # Coalesces render requests: requests arriving while a frame is drawn only update the pending value,
+    # which is drawn once when the event loop is idle again.
+    def __init__(self, render, parent=None, interval=0):
+        super(RenderScheduler, self).__init__(parent)
+        self.render = render
+        self.pending = None
+        self.interval = interval  # ms, minimum time between requested and drawn frames
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.on_timeout)
+
+    def request(self, val):
+        self.pending = val
+        if not self.timer.isActive():
+            self.timer.start(self.interval)
+
+    def on_timeout(self):
+        val, self.pending = self.pending, None
+        if val is not None:
+            self.render(val)
 
 
 class PlotCanvas(FigureCanvas):
@@ -907,6 +1133,15 @@ class PlotCanvas(FigureCanvas):
         self.data = data
         self.names = names
         self.times = times
+        # butterflies are one LineCollection; the selected channel and the time cursor are animated
+        # artists blitted over the background kept from the last full draw
+        self.overlay = None
+        self.cursor = None
+        self.cursor_x = 0
+        self.sel = None
+        self.background = None
+        self.pyramid = None
+        self.collection = None
 
         fig = Figure(figsize=(width, height), dpi=dpi)
         self.axes = fig.add_subplot(111)
@@ -915,7 +1150,8 @@ class PlotCanvas(FigureCanvas):
         self.setParent(parent)
 
         FigureCanvas.mpl_connect(self, s='button_press_event', func=self.on_click)
-        FigureCanvas.mpl_connect(self, s='resize_event', func=self.on_resize)
+        FigureCanvas.mpl_connect(self, s='draw_event', func=self.on_draw)
+        FigureCanvas.mpl_connect(self, s='resize_event', func=self.update_lod)
         # self.axes.callbacks.connect('ylim_changed', self.on_ylim_changed)
 
         FigureCanvas.setSizePolicy(self,
@@ -924,16 +1160,25 @@ class PlotCanvas(FigureCanvas):
         FigureCanvas.updateGeometry(self)
         self.plot(times, data, names, title)
 
-    def plot(self, times, data, names, title, seeg_show='Amplitude', ylim=None):
+    def plot(self, times, data, names, title, seeg_show='Amplitude', ylim=None, tix=None):
         # ax = self.figure.add_subplot(111)
         # ax = self.axes
         lines = None
 
         if data is not None:
-            if title == 'HDEEG':
-                lines = self.axes.plot(times, data, 'tab:orange', alpha=0.5, linewidth=0.5)
-            elif title == 'SEEG':
-                lines = self.axes.plot(times, data, 'tab:orange', alpha=0.6, linewidth=0.9)
+            if title in ['HDEEG', 'SEEG']:
+                # artists are created once and reused by later sessions and display modes
+                if self.collection is None:
+                    alpha, linewidth = (0.5, 0.5) if title == 'HDEEG' else (0.6, 0.9)
+                    self.collection = LineCollection([], colors='tab:orange', alpha=alpha, linewidths=linewidth)
+                    self.axes.add_collection(self.collection)
+                    self.axes.callbacks.connect('xlim_changed', self.update_lod)
+                    self.overlay = self.axes.plot([], [], 'tab:green', linewidth=3, animated=True)[0]
+                    self.cursor = self.axes.axvline(self.cursor_x, color='k', linestyle='--', animated=True)
+                lines = self.collection
+                self.pyramid = MinMaxPyramid(times, data)
+                if names != self.names:
+                    self.sel = None
             elif 'PCI' in title:
                 lines = self.axes.plot(times, data, 'tab:grey', alpha=0.8, linewidth=1.5)
 
@@ -965,11 +1210,16 @@ class PlotCanvas(FigureCanvas):
 
             self.axes.set_ylim(ylim)
             self.axes.set_xlim([np.min(times), np.max(times)])
+            if title in ['HDEEG', 'SEEG']:
+                self.update_lod()
 
             self.data = data
             self.names = names
             self.times = times
+            self.tix = TimeIndex(times) if tix is None else tix
             self.title = title
+            if self.overlay is not None:
+                self.update_overlay()
 
         self.axes.set_title(title)
         if 'PCI' not in title:
@@ -984,8 +1234,9 @@ class PlotCanvas(FigureCanvas):
             return
         x = event.xdata
         y = event.ydata
-        ix_t, = np.where(self.times == int(x))
-        indmin = (np.abs(self.data[ix_t, :] - y)).argmin()
+        if x is None:
+            return
+        indmin = (np.abs(self.data[self.tix[x]] - y)).argmin()
         # print(self.names[indmin])
         if self.title == 'SEEG':
             self.parent().parent().parent().seeg_select.setCurrentRow(indmin+1)
@@ -996,27 +1247,84 @@ class PlotCanvas(FigureCanvas):
         elif 'SEEG - PCI' in self.title:
             self.parent().parent().pcist_seeg_selector.setCurrentIndex(indmin)
 
-    def on_resize(self, axes):
-        if self.parent().parent() is not None:
-            if self.parent().parent().parent().bf_ready:
-                print('resize')
-                self.parent().parent().parent().update_blit(kind='HDEEG')
-                self.parent().parent().parent().update_blit(kind='SEEG')
+    def update_lod(self, event=None):
+        # traces are drawn from the min/max envelope matching the visible time range and axes width
+        if self.pyramid is None:
+            return
+        xlim = self.axes.get_xlim()
+        x, y = self.pyramid.envelope(xlim[0], xlim[1], self.axes.bbox.width)
+        segments = np.stack([np.broadcast_to(x[:, None], y.shape), y], axis=-1)
+        self.collection.set_segments(segments.transpose(1, 0, 2))
+
+    def set_labels(self, title=None, ylabel=None, xlabel=None):
+        if title is not None:
+            self.axes.set_title(title)
+        if ylabel is not None:
+            self.axes.set_ylabel(ylabel)
+        if xlabel is not None:
+            self.axes.set_xlabel(xlabel)
+
+    def get_ylim(self):
+        return self.axes.get_ylim()
+
+    def set_ylim(self, ylim):
+        # the cursor spans the axes height, so only the limits change; the draw refreshes the blit background
+        self.axes.set_ylim(ylim)
+        self.draw_idle()
+
+    def highlight(self, ix):
+        self.sel = ix
+        self.update_overlay()
+        self.blit_animated()
+
+    def update_overlay(self):
+        if self.sel is None:
+            self.overlay.set_data([], [])
+        else:
+            self.overlay.set_data(self.times, self.data[:, self.sel])
+
+    def set_cursor(self, x):
+        self.cursor_x = x
+        self.cursor.set_xdata([x, x])
+        self.blit_animated()
+
+    def on_draw(self, event):
+        # every full draw (including resizes) refreshes the blit background
+        if self.cursor is None:
+            return
+        self.background = self.copy_from_bbox(self.axes.bbox)
+        self.axes.draw_artist(self.overlay)
+        self.axes.draw_artist(self.cursor)
+
+    def blit_animated(self):
+        if self.background is None:
+            self.draw()
+            return
+        self.restore_region(self.background)
+        self.axes.draw_artist(self.overlay)
+        self.axes.draw_artist(self.cursor)
+        self.blit(self.axes.bbox)
 
 
 class WidgetPlot(QWidget):
     def __init__(self, data=None, times=None, names=None, title='title', *args, **kwargs):
         QWidget.__init__(self, *args, **kwargs)
         self.setLayout(QVBoxLayout())
-        self.canvas = PlotCanvas(self, width=10, height=8, data=data,
-                                 times=times, names=names, title=title)
-        self.toolbar = NavigationToolbar2QT(self.canvas, self)
+        if plot_backend == 'pyqtgraph' and title in ['HDEEG', 'SEEG']:
+            from coregview_pg import PgPlotCanvas
+            self.canvas = PgPlotCanvas(self, data=data, times=times, names=names, title=title)
+        else:
+            self.canvas = PlotCanvas(self, width=10, height=8, data=data,
+                                     times=times, names=names, title=title)
+            self.toolbar = NavigationToolbar2QT(self.canvas, self)
         # self.layout().addWidget(self.toolbar)
         self.layout().addWidget(self.canvas)
 
 
 class TopoPlot(FigureCanvas):
 
+    operators = {}  # interpolation operators per montage, shared by all topoplots
+
     def __init__(self, parent=None, width=5, height=4, dpi=100, data=None,
                  pos=None, title='%s ms', c_title='Amplitude\n ($\mu$V)', vmin=-20, vmax=20,
                  measure='Amp', cmap='bwr'):
@@ -1030,6 +1338,8 @@ class TopoPlot(FigureCanvas):
         self.vmax = vmax
         self.cmap = cmap
         self.c_title = c_title
+        self.im = None
+        self.cont = None
 
         FigureCanvas.__init__(self, fig)
         self.setParent(parent)
@@ -1058,17 +1368,40 @@ class TopoPlot(FigureCanvas):
         self.plot(self.data, self.title)
         # todo: use self.title, etc?
 
-    def plot(self, data, title):
-        self.ax.cla()
-        _ = mne.viz.plot_topomap(data, self.pos, vlim=(self.vmin, self.vmax),
-                                 axes=self.ax,
-                                 show=False, cmap=self.cmap)
+    def plot(self, data, title, grid=None):
+        if self.im is None:
+            # head, sensors and image are drawn once, afterwards only the image data is updated
+            self.ax.cla()
+            self.im, self.cont = mne.viz.plot_topomap(data, self.pos, vlim=(self.vmin, self.vmax),
+                                                      axes=self.ax,
+                                                      show=False, cmap=self.cmap)
+            montage = tuple(self.pos['ch_names'])
+            if montage not in TopoPlot.operators:
+                TopoPlot.operators[montage] = topomap_operator(self.pos)
+            self.interp_op, _, self.Xi, self.Yi = TopoPlot.operators[montage]
+        else:
+            if grid is None:
+                grid = self.interp_op @ np.asarray(data, dtype=float)
+            zi = grid.reshape(self.Xi.shape)
+            self.im.set_data(zi)
+            self.im.set_clim(self.vmin, self.vmax)
+            self.plot_contours(zi)
 
         # todo: FIX topomap adjust_subplot calls gcf which creates a new figure
         self.ax.set_title(title)
         self.title = title
         self.draw()
 
+    def plot_contours(self, zi, contours=6):
+        if self.cont is not None:
+            self.cont.remove()
+            self.cont = None
+        if np.isnan(zi).all() or (np.nanmax(zi) == np.nanmin(zi)):
+            return
+        self.cont = self.ax.contour(self.Xi, self.Yi, zi, contours, colors='k', linewidths=0.5,
+                                    zorder=self.im.get_zorder() + 1)
+        self.cont.set_clip_path(self.im.get_clip_path())
+
     def update_cbar(self, vmin, vmax):
         self.cax.clear()
         norm = mpl.colors.Normalize(vmin=vmin, vmax=vmax)
@@ -1114,6 +1447,9 @@ class SliderWidget(QWidget):
 
 
 class SeegLocs(FigureCanvas):
+    # Glass brain views (sagittal, coronal, axial) of the contacts. Outlines, stimulation site and colorbar are
+    # drawn once and cached; the contact markers are animated and only they are blitted on updates.
+    views = {'x': [1, 2], 'y': [0, 2], 'z': [0, 1]}  # view: columns of coords shown
 
     def __init__(self, parent=None, width=5, height=4, dpi=100, data=None,
                  coords=None, sel=None, stim_coords=None, seeg_show='Amplitude'):
@@ -1127,39 +1463,82 @@ class SeegLocs(FigureCanvas):
                                    QSizePolicy.Expanding,
                                    QSizePolicy.Expanding)
         FigureCanvas.updateGeometry(self)
+        self.background = None
+        self.markers = {}
+        self.stims = {}
+        self.mpl_connect('draw_event', self.on_draw)
         self.plot(data, coords, sel, stim_coords, seeg_show)
 
     def plot(self, data, coords, sel, stim_coords, seeg_show='Amplitude'):
         self.cmap = 'bwr' if seeg_show in ['Amplitude', 'Z-Score'] else 'viridis'
         self.cmap = plt.cm.bwr
-        adj_mat = np.zeros((len(coords), len(coords)))
         if data is None:
-            self.ax = self.figure.add_subplot(111)
-            self.conn = plot_connectome(adj_mat, node_coords=coords, node_color='tab:gray',
-                                        display_mode='ortho', node_size=15, axes=self.ax, black_bg=False)
-            self.conn.add_markers(stim_coords, marker_size=50, marker_color='g', marker='*')
+            self.figure.clear()
+            for i, (view, cols) in enumerate(SeegLocs.views.items()):
+                ax = self.figure.add_axes([i / 3, 0.2, 1 / 3, 0.75])
+                bounds = plot_brain_schematics(ax, view, alpha=0.3)
+                ax.set_xlim(bounds[0] - 5, bounds[1] + 5)
+                ax.set_ylim(bounds[2] - 5, bounds[3] + 5)
+                ax.set_aspect('equal')
+                ax.axis('off')
+                self.stims[view] = ax.scatter([], [], s=50, c='g', marker='*', zorder=3)
+                if stim_coords is not None:
+                    self.stims[view].set_offsets(np.atleast_2d(stim_coords)[:, cols])
+                self.markers[view] = ax.scatter(coords[:, cols[0]], coords[:, cols[1]], s=15, c='tab:gray',
+                                                animated=True, zorder=2)
 
             self.cax = self.figure.add_axes([0.27, 0.1, 0.5, 0.025])
             norm = mpl.colors.Normalize(vmin=-500, vmax=500)
             self.cb1 = mpl.colorbar.ColorbarBase(self.cax, cmap=self.cmap,
                                             norm=norm, orientation='horizontal')
             self.cb1.set_label(seeg_show)
+            self.draw()
 
         else:
-            self.conn.axes['x'].ax.collections[0].set_color(data)
-            self.conn.axes['y'].ax.collections[0].set_color(data)
-            self.conn.axes['z'].ax.collections[0].set_color(data)
+            for m in self.markers.values():
+                m.set_color(data)
 
             if sel is not None:
                 sizes = np.repeat(30, len(coords))
                 sizes[sel] = 200
-                self.conn.axes['x'].ax.collections[0].set_sizes(sizes)
-                self.conn.axes['y'].ax.collections[0].set_sizes(sizes)
-                self.conn.axes['z'].ax.collections[0].set_sizes(sizes)
+                for m in self.markers.values():
+                    m.set_sizes(sizes)
 
-            self.draw()
+            self.blit_markers()
         # todo: add plot navigation (zoom, save, etc) to seeg locs
 
+    def set_coords(self, coords, stim_coords):
+        # moves the markers to a new set of contacts, the brain outlines and colorbar are kept
+        for view, cols in SeegLocs.views.items():
+            self.markers[view].set_offsets(coords[:, cols])
+            self.markers[view].set_color('tab:gray')
+            self.markers[view].set_sizes([15])
+            if stim_coords is not None:
+                self.stims[view].set_offsets(np.atleast_2d(stim_coords)[:, cols])
+            else:
+                self.stims[view].set_offsets(np.empty((0, 2)))
+        self.draw()
+
+    def set_sizes(self, sizes):
+        for m in self.markers.values():
+            m.set_sizes(sizes)
+        self.blit_markers()
+
+    def on_draw(self, event):
+        # a full draw leaves out the animated markers, keep it as background and add them on top
+        self.background = self.copy_from_bbox(self.figure.bbox)
+        for m in self.markers.values():
+            m.axes.draw_artist(m)
+
+    def blit_markers(self):
+        if self.background is None:
+            self.draw()
+            return
+        self.restore_region(self.background)
+        for m in self.markers.values():
+            m.axes.draw_artist(m)
+        self.blit(self.figure.bbox)
+
     def update_cbar(self, vmin, vmax, title):
         norm = mpl.colors.Normalize(vmin=vmin, vmax=vmax)
         self.cax.clear()
@@ -1177,25 +1556,111 @@ class Surfaces(QDialog):
         layout.setContentsMargins(0, 0, 0, 0)
         layout.setSpacing(0)
 
+        # Paint the contact values on the cortex
+        self.project_box = QCheckBox('Project on cortex', self)
+        self.project_box.toggled.connect(self.on_project)
+        layout.addWidget(self.project_box)
+
         # PyVista Qt interactor
         self.plotter = QtInteractor(self)
         layout.addWidget(self.plotter.interactor)
-
-        load_hemis = ['lh', 'rh']
-        pial_surfs = {}
-        for h in load_hemis:
-            ndim_vect = np.repeat(3, len(parent.pial[h][1])).reshape(-1, 1)
-            pial_surf = pv.PolyData(parent.pial[h][0], np.hstack([ndim_vect, parent.pial[h][1]]))
-            pial_surfs[h] = pial_surf
-
-        for h in load_hemis:
-            self.plotter.add_mesh(pial_surfs[h], color='grey', opacity=0.4, show_edges=False)
-            pts = self.plotter.add_points(coords,scalars=vals, rgb=False, render_points_as_spheres=True,
-                                          point_size=25, color='k', cmap=cmap)
-            pts.mapper.SetScalarRange(lims[0], lims[1])
-            self.plotter.add_scalar_bar(mapper=pts.mapper)
+        self.subj_name = subj_name
+        self.operators = {}  # hemi: (projection operator, vertices without contacts) of the full and decimated meshes
+
+        if pials is None:
+            pials = parent.get_pial_meshes()
+        # hemi: (actor, full resolution mesh, decimated mesh shown while rotating)
+        self.meshes = {}
+        for h, meshes in pials.items():
+            actor = self.plotter.add_mesh(meshes[0], color='grey', opacity=0.4, show_edges=False)
+            self.meshes[h] = (actor, meshes[0], meshes[-1])
+
+        self.points = None
+        self.set_coords(coords, vals, lims, cmap)
+        # slider updates only change the point scalars, at most one render per frame
+        self.scheduler = RenderScheduler(self.render_values, parent=self, interval=33)
+
+        self.plotter.iren.add_observer('StartInteractionEvent', self.on_start_interaction)
+        self.plotter.iren.add_observer('EndInteractionEvent', self.on_end_interaction)
         self.plotter.show()
-        pass
+
+    def set_coords(self, coords, vals, lims, cmap):
+        # contact points are only re-created when the session changes
+        if self.points is not None:
+            self.plotter.remove_actor(self.points)
+            self.plotter.remove_scalar_bar()
+        self.coords = np.asarray(coords, dtype=float)
+        self.lims, self.cmap = lims, cmap
+        self.cloud = pv.PolyData(self.coords)
+        self.cloud['vals'] = np.asarray(vals, dtype=float)
+        self.points = self.plotter.add_mesh(self.cloud, scalars='vals', render_points_as_spheres=True,
+                                            point_size=25, cmap=cmap, show_scalar_bar=False)
+        self.points.mapper.SetScalarRange(lims[0], lims[1])
+        self.plotter.add_scalar_bar(mapper=self.points.mapper)
+        self.operators = {}
+        if self.project_box.isChecked():
+            self.on_project(True)
+
+    def set_display(self, lims, cmap):
+        self.lims, self.cmap = lims, cmap
+        actors = [self.points] + [actor for actor, full, lod in self.meshes.values()]
+        if not self.project_box.isChecked():
+            actors = actors[:1]
+        for actor in actors:
+            actor.mapper.lookup_table.cmap = cmap
+            actor.mapper.SetScalarRange(lims[0], lims[1])
+
+    def get_operators(self, h):
+        if h not in self.operators:
+            self.operators[h] = []
+            for i, mesh in enumerate(self.meshes[h][1:]):
+                proj_op = load_projection_operator(dir_cache, '%s_%s%i' % (self.subj_name, h, i), mesh.points,
+                                                   self.coords, max_mb=cache_max_mb)
+                self.operators[h].append((proj_op, proj_op.getnnz(1) == 0))
+        return self.operators[h]
+
+    def project_values(self, vals):
+        # one sparse mat-vec per mesh, vertices away from all contacts are left blank
+        for h, (actor, full, lod) in self.meshes.items():
+            for mesh, (proj_op, blank) in zip([full, lod], self.get_operators(h)):
+                proj = proj_op @ vals
+                proj[blank] = np.nan
+                if 'proj' in mesh.point_data:
+                    mesh['proj'][:] = proj
+                else:
+                    mesh['proj'] = proj
+
+    def on_project(self, checked):
+        vals = np.array(self.cloud['vals'])
+        for h, (actor, full, lod) in self.meshes.items():
+            self.plotter.remove_actor(actor)
+            if checked:
+                self.project_values(vals)
+                actor = self.plotter.add_mesh(full, scalars='proj', cmap=self.cmap, clim=self.lims,
+                                              nan_color='grey', opacity=0.6, show_scalar_bar=False)
+            else:
+                actor = self.plotter.add_mesh(full, color='grey', opacity=0.4, show_edges=False)
+            self.meshes[h] = (actor, full, lod)
+        self.plotter.render()
+
+    def set_values(self, vals):
+        self.scheduler.request(vals)
+
+    def render_values(self, vals):
+        self.cloud['vals'][:] = vals
+        self.cloud.Modified()
+        if self.project_box.isChecked():
+            self.project_values(np.asarray(vals, dtype=float))
+        self.plotter.render()
+
+    def on_start_interaction(self, *args):
+        for actor, full, lod in self.meshes.values():
+            actor.mapper.SetInputData(lod)
+
+    def on_end_interaction(self, *args):
+        for actor, full, lod in self.meshes.values():
+            actor.mapper.SetInputData(full)
+        self.plotter.render()
 
         # # Plot pial surface (must be a PyVista PolyData)
         #     if isinstance(pial, pv.PolyData):
@@ -1612,6 +2077,8 @@ class PciInfo(FigureCanvas):
 
 
 class Power(QDialog):
+    sort_names = {'hf': 'High-frequency', 'delta': 'Delta', 'plf': 'PLF'}
+
     def __init__(self, parent=App, data=None):
         super(Power, self).__init__(parent)
 
@@ -1619,7 +2086,9 @@ class Power(QDialog):
         self.setWindowTitle('Power')
 
         self.data = data
-        self.sorter = 'hf'
+        self.sorter = list(power_bands)[0]
+        self.tf_kind = None  # panel whose selected channel is shown in the TF view
+        self.window_box = {}
 
         # create layouts
         self.main_layout = QHBoxLayout()
@@ -1642,9 +2111,10 @@ class Power(QDialog):
         hdeeg_label_sort.setAlignment(Qt.AlignRight | Qt.AlignVCenter)
 
         hdeeg_sortby = QComboBox()
-        for s in ['High-frequency', 'Delta', 'PLF']:
-            hdeeg_sortby.addItem(s)
+        for m in list(power_bands) + ['delta', 'plf']:
+            hdeeg_sortby.addItem(self.sort_names.get(m, m))
         hdeeg_sortby.activated[str].connect(self.on_sort_select_hdeeg)
+        hdeeg_window = self.window_boxes('hdeeg', data['times'])
 
         self.hdeeg_ch_sel = QComboBox()
         for s in ch185:
@@ -1664,9 +2134,10 @@ class Power(QDialog):
         bip_label_sort.setAlignment(Qt.AlignRight | Qt.AlignVCenter)
 
         bip_sortby = QComboBox()
-        for s in ['High-frequency', 'Delta', 'PLF']:
-            bip_sortby.addItem(s)
+        for m in list(power_bands) + ['delta', 'plf']:
+            bip_sortby.addItem(self.sort_names.get(m, m))
         bip_sortby.activated[str].connect(self.on_sort_select_bip)
+        bip_window = self.window_boxes('bipo', data['times'])
 
         self.bip_ch_sel = QComboBox()
         for s in data['ersp_labels_bipo']:
@@ -1686,12 +2157,13 @@ class Power(QDialog):
         mono_label_sort.setAlignment(Qt.AlignRight | Qt.AlignVCenter)
 
         mono_sortby = QComboBox()
-        for s in ['High-frequency', 'Delta', 'PLF']:
-            mono_sortby.addItem(s)
+        for m in list(power_bands) + ['delta', 'plf']:
+            mono_sortby.addItem(self.sort_names.get(m, m))
         mono_sortby.activated[str].connect(self.on_sort_select_mono)
+        mono_window = self.window_boxes('mono', data['times'])
 
         self.mono_ch_sel = QComboBox()
-        for s in data['ersp_labels_mono']:
+        for s in (data['ersp_labels_mono'] if 'ersp_mono' in data else []):
             self.mono_ch_sel.addItem(s)
         self.mono_ch_sel.activated[str].connect(self.on_mono_ch_sel)
 
@@ -1701,7 +2173,8 @@ class Power(QDialog):
         # plots
         self.plots_hdeeg = PowerPlots(parent=self, data=data, kind='hdeeg')
         self.plots_bip = PowerPlots(parent=self, data=data, kind='bipo')
-        self.plots_mono = PowerPlots(parent=self, data=data, kind='mono')
+        # the in-app decomposition has no monopolar SEEG (see App.fx_compute_power)
+        self.plots_mono = PowerPlots(parent=self, data=data, kind='mono') if 'ersp_mono' in data else None
 
         # fill layouts
         self.menu_hdeeg_layout.addWidget(hdeeg_label, 0, 0, 1, 4)
@@ -1709,67 +2182,101 @@ class Power(QDialog):
         self.menu_hdeeg_layout.addWidget(hdeeg_sortby, 1, 2, 1, 1)
         self.menu_hdeeg_layout.addWidget(self.hdeeg_ch_sel, 2, 1, 1, 1)
         self.menu_hdeeg_layout.addWidget(hdeeg_tf_but, 2, 2, 1, 1)
+        for ix, w in enumerate(hdeeg_window):
+            self.menu_hdeeg_layout.addWidget(w, 3, ix + 1, 1, 1)
 
         self.menu_bip_layout.addWidget(bip_label, 0, 0, 1, 4)
         self.menu_bip_layout.addWidget(bip_label_sort, 1, 1, 1, 1)
         self.menu_bip_layout.addWidget(bip_sortby, 1, 2, 1, 1)
         self.menu_bip_layout.addWidget(self.bip_ch_sel, 2, 1, 1, 1)
         self.menu_bip_layout.addWidget(bip_tf_but, 2, 2, 1, 1)
+        for ix, w in enumerate(bip_window):
+            self.menu_bip_layout.addWidget(w, 3, ix + 1, 1, 1)
 
         self.menu_mono_layout.addWidget(mono_label, 0, 0, 1, 4)
         self.menu_mono_layout.addWidget(mono_label_sort, 1, 1, 1, 1)
         self.menu_mono_layout.addWidget(mono_sortby, 1, 2, 1, 1)
         self.menu_mono_layout.addWidget(self.mono_ch_sel, 2, 1, 1, 1)
         self.menu_mono_layout.addWidget(mono_tf_but, 2, 2, 1, 1)
+        for ix, w in enumerate(mono_window):
+            self.menu_mono_layout.addWidget(w, 3, ix + 1, 1, 1)
 
         self.hdeeg_layout.addLayout(self.menu_hdeeg_layout)
         self.hdeeg_layout.addWidget(self.plots_hdeeg)
         self.bip_layout.addLayout(self.menu_bip_layout)
         self.bip_layout.addWidget(self.plots_bip)
         self.mono_layout.addLayout(self.menu_mono_layout)
-        self.mono_layout.addWidget(self.plots_mono)
+        if self.plots_mono is not None:
+            self.mono_layout.addWidget(self.plots_mono)
 
         self.main_layout.addLayout(self.hdeeg_layout)
         self.main_layout.addLayout(self.bip_layout)
-        self.main_layout.addLayout(self.mono_layout)
+        if self.plots_mono is not None:
+            self.main_layout.addLayout(self.mono_layout)
+        else:
+            mono_tf_but.hide()
+
+        self.tf_panel = TfPanel(parent=self)
+        self.main_layout.addWidget(self.tf_panel)
 
         self.setLayout(self.main_layout)
 
         self.show()
 
+    def sort_key(self, name):
+        keys = {v: k for k, v in self.sort_names.items()}
+        return keys.get(name, name)
+
+    def window_boxes(self, kind, times):
+        # label and tmin/tmax boxes of the window averaged to sort the channels of a panel
+        label = QLabel()
+        label.setText('Sort window (ms):')
+        label.setAlignment(Qt.AlignRight | Qt.AlignVCenter)
+        boxes = []
+        for t in sort_window:
+            box = QSpinBox()
+            box.setRange(int(np.min(times)), int(np.max(times)))
+            box.setSingleStep(50)
+            box.setValue(int(t))
+            box.valueChanged.connect(lambda _, kind=kind: self.on_sort_window(kind))
+            boxes.append(box)
+        self.window_box[kind] = boxes
+        return [label] + boxes
+
+    def on_sort_window(self, kind):
+        tmin, tmax = (b.value() for b in self.window_box[kind])
+        if tmin >= tmax:
+            return
+        plots = self.plots_hdeeg if kind == 'hdeeg' else self.plots_bip if kind == 'bipo' else self.plots_mono
+        plots.set_window((tmin, tmax))
+
     def on_sort_select_hdeeg(self, sorter):
-        sorter = str(sorter)
-        self.sorter = 'hf' if sorter == 'High-frequency' else 'delta' if \
-            sorter == 'Delta' else 'plf' if sorter == 'PLF' else None
+        self.sorter = self.sort_key(str(sorter))
         self.plots_hdeeg.plot_raster(sorter=self.sorter)
 
     def on_sort_select_bip(self, sorter):
-        sorter = str(sorter)
-        self.sorter = 'hf' if sorter == 'High-frequency' else 'delta' if \
-            sorter == 'Delta' else 'plf' if sorter == 'PLF' else None
+        self.sorter = self.sort_key(str(sorter))
         self.plots_bip.plot_raster(sorter=self.sorter)
 
     def on_sort_select_mono(self, sorter):
-        sorter = str(sorter)
-        self.sorter = 'hf' if sorter == 'High-frequency' else 'delta' if \
-            sorter == 'Delta' else 'plf' if sorter == 'PLF' else None
+        self.sorter = self.sort_key(str(sorter))
         self.plots_mono.plot_raster(sorter=self.sorter)
 
     def on_hdeeg_ch_sel(self, chan):
         ch = str(chan)
         ix = ch185.index(ch)
         print(ix, chan)
-        self.plots_hdeeg.plot_raster(sorter=self.sorter, curr_ix=ix)
+        self.plots_hdeeg.plot_raster(sorter=self.plots_hdeeg.sorter, curr_ix=ix)
 
     def on_bip_ch_sel(self, chan):
         ch = str(chan)
         ix = list(self.data['ersp_labels_bipo']).index(ch)
-        self.plots_bip.plot_raster(sorter=self.sorter, curr_ix=ix)
+        self.plots_bip.plot_raster(sorter=self.plots_bip.sorter, curr_ix=ix)
 
     def on_mono_ch_sel(self, chan):
         ch = str(chan)
         ix = list(self.data['ersp_labels_mono']).index(ch)
-        self.plots_mono.plot_raster(sorter=self.sorter, curr_ix=ix)
+        self.plots_mono.plot_raster(sorter=self.plots_mono.sorter, curr_ix=ix)
 
     def on_open_tf_hdeeg(self):
         self.plots_hdeeg.plot_tf()
@@ -1780,6 +2287,12 @@ class Power(QDialog):
     def on_open_tf_mono(self):
         self.plots_mono.plot_tf()
 
+    def closeEvent(self, event):
+        # panels read their fields lazily, the power file is only kept open while the dialog is
+        self.tf_panel.stop_prefetch()
+        self.data.close()
+        super(Power, self).closeEvent(event)
+
 
 class PowerPlots(FigureCanvas):
     def __init__(self, parent=None, width=5, height=4, dpi=100, data=None,
@@ -1798,149 +2311,253 @@ class PowerPlots(FigureCanvas):
 
         FigureCanvas.mpl_connect(self, s='button_press_event', func=self.on_click)
 
-        self.measures = ['hf', 'delta', 'plf']
+        self.measures = list(power_bands) + ['delta', 'plf']
         self.kind = kind
         self.labels = ch185 if kind == 'hdeeg' else list(data['ersp_labels_%s' % kind])
         self.curr_ix = 0
 
-        self.data = {}
-        self.data['ersp'] = data['ersp_%s' % kind][:, :, :]
-        self.data['hf'] = data['ersp_%s' % kind][:, data['ersp_freqs_%s' % kind] > 20, :].mean(1)
-        self.data['delta'] = data['delta_%s' % kind].mean(2)
-        self.data['plf'] = data['plf_stat_%s' % kind]
-        self.stats = data['erspboot_%s' % kind]
-
+        self.power = data
         self.times_ersp = data['ersp_times_%s' % kind]
         self.times = data['times']
-
-        self.sorters = {}
-        self.abs_max = {}
         self.freqs = data['ersp_freqs_%s' % kind]
 
-        hf_ch = self.data['hf'][:, (self.times_ersp > 0) & (self.times_ersp < 300)].mean(1)
-        self.sorters['hf'] = hf_ch.argsort()
-
-        delta_ch = self.data['delta'][:, (self.times > 0) & (self.times < 300)].mean(1)
-        self.sorters['delta'] = delta_ch.argsort()
-
-        plf_ch = self.data['plf'][:, (self.times > 0) & (self.times < 300)].mean(1)
-        self.sorters['plf'] = plf_ch.argsort()
-
-        self.abs_max['hf'] = np.max(np.abs(self.data['hf']))
-        self.abs_max['delta'] = np.max(np.abs(self.data['delta']))
+        # band means come from the cumulative sum of the ERSP over frequencies, channel sorting is done lazily
+        self.bands = BandMeans(lambda ix: data.channel('ersp_%s' % kind, ix), len(self.labels), self.freqs,
+                               self.times_ersp)
+        self.data = {m: self.bands.band(power_bands[m]) for m in power_bands}
+        self.data['delta'] = data['delta_%s' % kind].mean(2)
+        self.data['plf'] = data['plf_stat_%s' % kind]
 
+        self.abs_max = {m: np.max(np.abs(self.data[m])) for m in self.measures if m != 'plf'}
         self.nchans = {m: self.data[m].shape[0] for m in self.measures}
 
+        self.time_window = tuple(sort_window)
+        self.orders = {}
+
         self.sorted_data = []
+        self.sorter = None
+        self.sorted_key = None
+        self.images = {}
+        self.traces = {}
+        self.arrows = {}
+        self.background = None
+        FigureCanvas.mpl_connect(self, s='draw_event', func=self.on_draw)
 
         if kind in ['hdeeg', 'bipo', 'mono']:
             self.plot_raster()
 
-    def plot_raster(self, sorter='hf', curr_ix=None):
+    def build_raster(self):
+        # rasters, colorbars and axes are created once; traces and arrows are animated and blitted on top
         self.fig.clear()
-        self.axes = self.fig.subplots(3, 2)
-        self.sorter = sorter
-
-        sorter_all = self.sorters['hf'] if sorter == 'hf' else self.sorters['delta'] if \
-            sorter == 'delta' else self.sorters['plf']
-
-        self.sorted_labels = [self.labels[i] for i in sorter_all]
-
-        self.sorted_data = {k: self.data[k][sorter_all] for k in self.measures}
-
+        self.axes = self.fig.subplots(len(self.measures), 2, squeeze=False)
         for ix, m in enumerate(self.measures):
-            cmap = 'plasma' if m == 'plf' else 'coolwarm' if m == 'hf' else 'viridis'
+            cmap = 'plasma' if m == 'plf' else 'coolwarm' if m in power_bands else 'viridis'
             vmin = 0 if m == 'plf' else -self.abs_max[m]
             vmax = 1 if m == 'plf' else self.abs_max[m]
 
-            tmin = self.times_ersp[0] if m == 'hf' else self.times[0]
-            tmax = self.times_ersp[-1] if m == 'hf' else self.times[-1]
-
-            im = self.axes[ix, 0].imshow(self.sorted_data[m], extent=(tmin, tmax, self.nchans[m], 1),
-                                         aspect='auto', cmap=cmap, vmin=vmin, vmax=vmax)
-
-
-            cb = self.fig.colorbar(im, ax=self.axes[ix, 0])
+            tmin = self.times_ersp[0] if m in power_bands else self.times[0]
+            tmax = self.times_ersp[-1] if m in power_bands else self.times[-1]
 
+            self.images[m] = self.axes[ix, 0].imshow(self.data[m], extent=(tmin, tmax, self.nchans[m], 1),
+                                                     aspect='auto', cmap=cmap, vmin=vmin, vmax=vmax)
+            cb = self.fig.colorbar(self.images[m], ax=self.axes[ix, 0])
             cb.ax.set_title(m)
 
-            if curr_ix is None:
-                self.curr_ix = sorter_all.argsort().argmax()
-                self.arrow_ix = len(self.labels)
-            else:
-                self.curr_ix = curr_ix
-                self.arrow_ix = sorter_all.argsort()[curr_ix]
-
-            if self.kind == 'hdeeg':
-                self.parent().hdeeg_ch_sel.setCurrentIndex(self.curr_ix)
-            elif self.kind == 'bipo':
-                self.parent().bip_ch_sel.setCurrentIndex(self.curr_ix)
-            else:
-                self.parent().mono_ch_sel.setCurrentIndex(self.curr_ix)
-
             times = self.times if m in ['delta', 'plf'] else self.times_ersp
-
-            self.axes[ix, 1].plot(times, self.data[m][self.curr_ix, :])
+            self.traces[m] = self.axes[ix, 1].plot(times, np.zeros(len(times)), animated=True)[0]
+            self.axes[ix, 1].set_ylim(vmin, vmax)
             self.axes[ix, 0].set_ylabel('sorted channels')
             self.axes[ix, 1].set_ylabel(m)
 
-            # todo: match indexes
-
-            self.axes[ix, 0].annotate('', xy=(tmax, self.arrow_ix),
-                                      xytext=(tmax+10, self.arrow_ix),
-                                      arrowprops=dict(arrowstyle="->", color='g'))
+            self.arrows[m] = self.axes[ix, 0].annotate('', xy=(tmax, 0), xytext=(tmax+10, 0),
+                                                       arrowprops=dict(arrowstyle="->", color='g'))
+            self.arrows[m].set_animated(True)
 
         for ax in self.axes.flatten():
             ax.vlines(x=0, ymin=ax.get_ylim()[0], ymax=ax.get_ylim()[1],
                       linestyles='--', alpha=0.4)
 
         for i in range(2):
-            self.axes[2, i].set_xlabel('times (ms)')
+            self.axes[-1, i].set_xlabel('times (ms)')
 
         self.fig.tight_layout()
-        self.draw()
 
-    def plot_tf(self):
-        # todo: put in widget to avoid loop running warnings
-        fig, ax = plt.subplots(1, 1)
-        vmax = np.max(np.abs(self.data['ersp'][self.curr_ix, :, :]))
-        vmin = -vmax
-
-        ch_stats = self.stats[self.curr_ix, :, :]
-        data = self.data['ersp'][self.curr_ix, :, :]
+    def sort_order(self, m):
+        # channels sorted by the mean of measure m over the sorting window, the rank of each channel and the
+        # sorted labels; memoized per (measure, window)
+        key = (m, self.time_window)
+        if key not in self.orders:
+            if m in power_bands:
+                vals = self.bands.window_mean(power_bands[m], self.time_window)
+            else:
+                vals = self.data[m][:, (self.times > self.time_window[0]) & (self.times < self.time_window[1])].mean(1)
+            order = vals.argsort()
+            self.orders[key] = (order, order.argsort(), [self.labels[i] for i in order])
+        return self.orders[key]
+
+    def set_window(self, window):
+        self.time_window = tuple(window)
+        if self.sorter is not None:
+            self.plot_raster(sorter=self.sorter, curr_ix=self.curr_ix)
+
+    def plot_raster(self, sorter=None, curr_ix=None):
+        sorter = self.measures[0] if sorter is None else sorter
+        if (sorter, self.time_window) != self.sorted_key:
+            if not self.images:
+                self.build_raster()
+            self.sorter = sorter
+            self.sorted_key = (sorter, self.time_window)
+            sorter_all, _, self.sorted_labels = self.sort_order(sorter)
+            self.sorted_data = {k: self.data[k][sorter_all] for k in self.measures}
+            for m in self.measures:
+                self.images[m].set_data(self.sorted_data[m])
+            self.select(curr_ix)
+            self.draw()
+        else:
+            self.select(curr_ix)
+            self.blit_traces()
+        if self.parent().tf_kind == self.kind:
+            self.plot_tf()
+
+    def select(self, curr_ix=None):
+        # the rasters span y = 1 (first sorted channel) to y = n channels, so a channel is drawn at its rank + 1
+        if curr_ix is None:
+            self.curr_ix = self.sort_order(self.sorter)[0][-1]
+            self.arrow_ix = len(self.labels)
+        else:
+            self.curr_ix = curr_ix
+            self.arrow_ix = self.sort_order(self.sorter)[1][curr_ix] + 1
 
-        low_th = np.repeat(ch_stats[:, 0].reshape(ch_stats.shape[0], -1), data.shape[1], axis=1)
-        high_th = np.repeat(ch_stats[:, 1].reshape(ch_stats.shape[0], -1), data.shape[1], axis=1)
-        mask = np.ma.masked_where((data > low_th) & (data < high_th), data)
+        if self.kind == 'hdeeg':
+            self.parent().hdeeg_ch_sel.setCurrentIndex(self.curr_ix)
+        elif self.kind == 'bipo':
+            self.parent().bip_ch_sel.setCurrentIndex(self.curr_ix)
+        else:
+            self.parent().mono_ch_sel.setCurrentIndex(self.curr_ix)
 
-        ax.imshow(data, aspect='auto', cmap='Greys',
-                  extent=(self.times_ersp[0], self.times_ersp[-1],
-                          self.freqs[0], self.freqs[-1]), vmin=vmin, vmax=vmax,
-                  origin='lower', interpolation='lanczos')
+        for m in self.measures:
+            self.traces[m].set_ydata(self.data[m][self.curr_ix, :])
+            tmax = self.arrows[m].xy[0]
+            self.arrows[m].xy = (tmax, self.arrow_ix)
+            self.arrows[m].xyann = (tmax+10, self.arrow_ix)
 
-        im = ax.imshow(mask, aspect='auto', cmap='coolwarm',
-                  extent=(self.times_ersp[0], self.times_ersp[-1],
-                          self.freqs[0], self.freqs[-1]), vmin=vmin, vmax=vmax,
-                  origin='lower', interpolation='nearest')
+    def on_draw(self, event):
+        self.background = self.copy_from_bbox(self.fig.bbox)
+        self.draw_traces()
 
-        cb = self.fig.colorbar(im, ax=ax)
+    def draw_traces(self):
+        for m in self.measures:
+            self.traces[m].axes.draw_artist(self.traces[m])
+            self.arrows[m].axes.draw_artist(self.arrows[m])
 
-        cb.ax.set_title('ersp')
+    def blit_traces(self):
+        if self.background is None:
+            self.draw()
+            return
+        self.restore_region(self.background)
+        self.draw_traces()
+        self.blit(self.fig.bbox)
 
-        ax.set_ylabel('Frequency (Hz)')
-        ax.set_xlabel('Time (ms)')
-        ax.vlines(x=0, ymin=ax.get_ylim()[0], ymax=ax.get_ylim()[1],
-                  linestyles='--', alpha=0.4)
-        ax.set_title(self.labels[self.curr_ix])
-        plt.show()
+    def plot_tf(self):
+        self.parent().tf_kind = self.kind
+        self.parent().tf_panel.show_channel(self, self.curr_ix)
 
     def on_click(self, event):
+        if event.inaxes not in self.axes[:, 0] or event.ydata is None:
+            return
         y = event.ydata
         selected_ch = self.sorted_labels[int(y)-1]
         curr_ix = self.labels.index(selected_ch)
         self.plot_raster(sorter=self.sorter, curr_ix=curr_ix)
 
 
+class TfPanel(FigureCanvas):
+    # Time-frequency view of the selected channel of a PowerPlots panel. Rendered channel images are kept in a
+    # small LRU and the neighbouring channels in the panel's sort order are rendered in the background.
+    def __init__(self, parent=None, width=5, height=4, dpi=100, prefetch=2):
+        fig = Figure(figsize=(width, height), dpi=dpi)
+        FigureCanvas.__init__(self, fig)
+        self.setParent(parent)
+
+        FigureCanvas.setSizePolicy(self,
+                                   QSizePolicy.Expanding,
+                                   QSizePolicy.Expanding)
+        FigureCanvas.updateGeometry(self)
+
+        self.ax = fig.add_subplot(111)
+        self.im = None
+        self.images = SessionCache(max_mb=tf_cache_mb)
+        self.prefetch = prefetch
+        self.prefetcher = None
+        self.prefetchers = []  # started prefetchers, interrupted ones may still be rendering a channel
+
+    @staticmethod
+    def render(power, kind, ix):
+        rgba, vmax = tf_image(power.channel('ersp_%s' % kind, ix), power.channel('erspboot_%s' % kind, ix))
+        return {'rgba': rgba, 'vmax': vmax}
+
+    def show_channel(self, plots, ix):
+        key = (plots.kind, ix)
+        entry = self.images.get(key)
+        if entry is None:
+            entry = self.render(plots.power, plots.kind, ix)
+            self.images.put(key, entry)
+
+        extent = (plots.times_ersp[0], plots.times_ersp[-1], plots.freqs[0], plots.freqs[-1])
+        if self.im is None:
+            self.im = self.ax.imshow(entry['rgba'], aspect='auto', extent=extent, origin='lower',
+                                     interpolation='nearest')
+            self.sm = cm.ScalarMappable(norm=mpl.colors.Normalize(), cmap='coolwarm')
+            cb = self.figure.colorbar(self.sm, ax=self.ax)
+            cb.ax.set_title('ersp')
+            self.ax.set_ylabel('Frequency (Hz)')
+            self.ax.set_xlabel('Time (ms)')
+            self.ax.axvline(0, linestyle='--', color='k', alpha=0.4)
+        else:
+            self.im.set_data(entry['rgba'])
+            self.im.set_extent(extent)
+        self.sm.set_clim(-entry['vmax'], entry['vmax'])
+        self.ax.set_title(plots.labels[ix])
+        self.draw()
+        self.start_prefetch(plots, ix)
+
+    def start_prefetch(self, plots, ix):
+        order, ranks, _ = plots.sort_order(plots.sorter)
+        rank = ranks[ix]
+        ranks = [r for d in range(1, self.prefetch + 1) for r in (rank + d, rank - d) if 0 <= r < len(order)]
+        ixs = [order[r] for r in ranks if (plots.kind, order[r]) not in self.images]
+        if self.prefetcher is not None:
+            self.prefetcher.requestInterruption()
+            self.prefetcher = None
+        self.prefetchers = [w for w in self.prefetchers if not w.isFinished()]
+        if ixs:
+            self.prefetcher = Worker(self.fx_prefetch, plots.power, plots.kind, ixs)
+            self.prefetcher.done.connect(self.on_prefetched)
+            self.prefetchers.append(self.prefetcher)
+            self.prefetcher.start()
+
+    def stop_prefetch(self):
+        for w in self.prefetchers:
+            w.requestInterruption()
+        for w in self.prefetchers:
+            w.wait()
+        self.prefetchers = []
+        self.prefetcher = None
+
+    def fx_prefetch(self, worker, power, kind, ixs):
+        entries = []
+        for ix in ixs:
+            if worker.isInterruptionRequested():
+                break
+            entries.append(((kind, ix), self.render(power, kind, ix)))
+        return entries
+
+    def on_prefetched(self, entries):
+        for key, entry in entries:
+            if key not in self.images:
+                self.images.put(key, entry)
+
+
 if __name__ == '__main__':
     app = QApplication(sys.argv)
     icon = os.path.join(dir_resources, 'coregview_icon.png')
@@ -0,0 +1,121 @@
+import numpy as np
+import pyqtgraph as pg
+from PyQt5.QtCore import Qt
+from PyQt5.QtWidgets import QGraphicsItem
+from coregview_fx import TimeIndex, MinMaxPyramid
+
+
+class PgPlotCanvas(pg.PlotWidget):
+    # pyqtgraph version of the HDEEG/SEEG butterflies of PlotCanvas (plot, on_click, highlight, set_cursor,
+    # set_ylim), for smooth scrubbing with many channels. Enabled with plot_backend = 'pyqtgraph'.
+    pyramid = None
+
+    def __init__(self, parent=None, data=None, times=None, names=None, title='title'):
+        pg.PlotWidget.__init__(self, parent=parent, background='w')
+        self.data = data
+        self.names = names
+        self.times = times
+        self.title = title
+        self.sel = None
+
+        self.plotItem.hideButtons()
+        self.plotItem.setMenuEnabled(False)
+        # all channels are one curve broken between channels, cached as a pixmap so that moving the cursor or
+        # the overlay does not repaint the traces
+        self.curve = pg.PlotDataItem(connect='finite')
+        self.curve.curve.setCacheMode(QGraphicsItem.DeviceCoordinateCache)
+        self.overlay = pg.PlotDataItem(pen=pg.mkPen('#2ca02c', width=3))
+        self.cursor = pg.InfiniteLine(pos=0, angle=90, pen=pg.mkPen('k', style=Qt.DashLine))
+        self.addItem(self.curve)
+        self.addItem(self.overlay)
+        self.addItem(self.cursor)
+        self.scene().sigMouseClicked.connect(self.on_click)
+        self.plotItem.vb.sigXRangeChanged.connect(self.update_lod)
+        self.plot(times, data, names, title)
+
+    def plot(self, times, data, names, title, seeg_show='Amplitude', ylim=None, tix=None):
+        if data is not None:
+            alpha = 128 if title == 'HDEEG' else 153
+            self.curve.setPen(pg.mkPen((255, 127, 14, alpha), width=1))
+            self.pyramid = MinMaxPyramid(times, data)
+
+            if ylim is None:
+                ylim = [np.min(data) + np.min(data)*0.1, np.max(data) + np.max(data)*0.1]
+            if (title == 'SEEG') and (seeg_show == 'Absolute'):
+                ylim = [0, np.max(np.abs(data)) * 1.1]
+
+            if title == 'HDEEG':
+                self.parent().parent().parent().vmin_hdeeg = ylim[0]
+                self.parent().parent().parent().vmax_hdeeg = ylim[1]
+            elif title == 'SEEG':
+                self.parent().parent().parent().vmin_seeg = ylim[0]
+                self.parent().parent().parent().vmax_seeg = ylim[1]
+
+            self.setYRange(ylim[0], ylim[1], padding=0)
+            self.setXRange(np.min(times), np.max(times), padding=0)
+
+            if names != self.names:
+                self.sel = None
+            self.data = data
+            self.names = names
+            self.times = times
+            self.tix = TimeIndex(times) if tix is None else tix
+            self.title = title
+            self.update_overlay()
+            self.update_lod()
+
+        self.set_labels(title=title, ylabel=seeg_show, xlabel='Time (ms)')
+        return self.curve
+
+    def update_lod(self, *args):
+        # traces are drawn from the min/max envelope matching the visible time range and widget width
+        if self.pyramid is None:
+            return
+        xlim = self.plotItem.vb.viewRange()[0]
+        x, y = self.pyramid.envelope(xlim[0], xlim[1], self.plotItem.vb.width())
+        self.curve.setData(np.tile(np.r_[x, np.nan], y.shape[1]),
+                           np.vstack([y, np.full((1, y.shape[1]), np.nan)]).T.ravel())
+
+    def resizeEvent(self, event):
+        pg.PlotWidget.resizeEvent(self, event)
+        self.update_lod()
+
+    def set_labels(self, title=None, ylabel=None, xlabel=None):
+        if title is not None:
+            self.setTitle(title, color='k')
+        if ylabel is not None:
+            self.setLabel('left', ylabel.replace(r'($\mu$V)', '(µV)'))
+        if xlabel is not None:
+            self.setLabel('bottom', xlabel)
+
+    def on_click(self, event):
+        if self.data is None or not self.plotItem.sceneBoundingRect().contains(event.scenePos()):
+            return
+        point = self.plotItem.vb.mapSceneToView(event.scenePos())
+        indmin = (np.abs(self.data[self.tix[point.x()]] - point.y())).argmin()
+        if self.title == 'SEEG':
+            self.parent().parent().parent().seeg_select.setCurrentRow(indmin+1)
+        elif self.title == 'HDEEG':
+            self.parent().parent().parent().hdeeg_select.setCurrentRow(indmin+1)
+
+    def highlight(self, ix):
+        self.sel = ix
+        self.update_overlay()
+
+    def update_overlay(self):
+        if self.sel is None:
+            self.overlay.setData([], [])
+        else:
+            self.overlay.setData(self.times, self.data[:, self.sel])
+
+    def set_cursor(self, x):
+        self.cursor.setValue(x)
+
+    def set_ylim(self, ylim):
+        self.setYRange(ylim[0], ylim[1], padding=0)
+
+    def get_ylim(self):
+        return tuple(self.plotItem.vb.viewRange()[1])
+
+    def draw(self):
+        self.update()